@@ -7,9 +7,14 @@ import numpy as np
 import torch
 import torch.autograd as autograd
 from cyy_naive_lib.algorithm.sequence_op import split_list_to_chunks
-
-from data_structure.cuda_process_task_queue import CUDAProcessTaskQueue
-from device import get_cuda_devices
+from cyy_naive_lib.log import get_logger
+
+from data_structure.torch_process_task_queue import (
+    TorchProcessTaskQueue,
+    WorkerSession,
+    get_worker_session_state,
+)
+from device import get_devices, put_data_to_device
 from model_loss import ModelWithLoss
 from model_util import ModelUtil
 from tensor import cat_tensors_to_vector
@@ -57,59 +62,104 @@ def load_model_parameters(model, parameters: torch.Tensor, param_shape_dict, dev
     assert bias == len(parameters)
 
 
-def __get_f(device, inputs, targets, model_with_loss, param_shape_dict):
-    def f(*args):
-        nonlocal inputs, targets, model_with_loss, param_shape_dict, device
-        model_snapshots = ModelSnapshot.resize_and_get(
-            model_with_loss.model, device, len(args)
+def get_gradient_graph(
+    model_with_loss: ModelWithLoss,
+    parameter_vector: torch.Tensor,
+    param_shape_dict: dict,
+    inputs,
+    targets,
+):
+    r"""
+    Return the parameter vector and the gradient of the loss with respect to it, the latter keeps its graph for double-backward.
+    """
+    device = parameter_vector.device
+    model_with_loss.model.to(device)
+    parameter_vector = parameter_vector.detach().requires_grad_()
+    load_model_parameters(
+        model_with_loss.model, parameter_vector, param_shape_dict, device
+    )
+    loss = model_with_loss(inputs, targets)["loss"]
+    gradient = autograd.grad(loss, parameter_vector, create_graph=True)[0]
+    return (parameter_vector, gradient)
+
+
+def get_gradient_graph_and_size(*args) -> tuple:
+    r"""
+    Return the result of get_gradient_graph and the bytes of the tensors saved for its double-backward.
+    """
+    graph_bytes = 0
+
+    def pack_hook(tensor):
+        nonlocal graph_bytes
+        graph_bytes += tensor.nelement() * tensor.element_size()
+        return tensor
+
+    with autograd.graph.saved_tensors_hooks(pack_hook, lambda tensor: tensor):
+        gradient_graph = get_gradient_graph(*args)
+    return (gradient_graph, graph_bytes)
+
+
+def can_cache_graph(graph_bytes: int, max_cached_graph_bytes) -> bool:
+    if max_cached_graph_bytes is None or graph_bytes <= max_cached_graph_bytes:
+        return True
+    get_logger().warning(
+        "gradient graph uses %s bytes, which exceeds the cap %s, so it is not cached",
+        graph_bytes,
+        max_cached_graph_bytes,
+    )
+    return False
+
+
+def get_products_from_gradient_graph(
+    parameter_vector: torch.Tensor,
+    gradient: torch.Tensor,
+    vectors: list,
+    retain_graph: bool = False,
+) -> list:
+    if len(vectors) == 1:
+        return list(
+            autograd.grad(
+                gradient,
+                parameter_vector,
+                grad_outputs=vectors[0],
+                retain_graph=retain_graph,
+            )
         )
-        assert len(model_snapshots) >= len(args)
-        total_loss = None
-        temp_model_with_loss: ModelWithLoss = copy.deepcopy(model_with_loss)
-        for i, arg in enumerate(args):
-            cur_model_snapshot = model_snapshots[i]
-            load_model_parameters(cur_model_snapshot, arg, param_shape_dict, device)
-            cur_model_snapshot.to(device)
-            temp_model_with_loss.set_model(cur_model_snapshot)
-            loss = temp_model_with_loss(inputs, targets)["loss"]
-            if total_loss is None:
-                total_loss = loss
-            else:
-                total_loss += loss
-        return total_loss
-
-    return f
+    products = autograd.grad(
+        gradient,
+        parameter_vector,
+        grad_outputs=torch.stack(vectors),
+        retain_graph=retain_graph,
+        is_grads_batched=True,
+    )[0]
+    return list(products)
 
 
 def worker_fun(task, args):
-    (
-        idx,
-        vector_chunk,
-        model_with_loss,
-        parameter_dict,
-        input_dict,
-        target_dict,
-        param_shape_dict,
-    ) = task
+    (idx, vector_chunk, session) = task
     worker_device = args[0]
-    for index, vector in enumerate(vector_chunk):
-        vector_chunk[index] = vector.to(worker_device)
-    inputs = input_dict.get(str(worker_device))
-    targets = target_dict.get(str(worker_device))
-    parameter_vector = parameter_dict.get(str(worker_device))
-    vector_chunk = tuple(vector_chunk)
-    products = autograd.functional.vhp(
-        __get_f(
-            worker_device,
-            inputs,
-            targets,
-            model_with_loss,
-            param_shape_dict,
-        ),
-        tuple([parameter_vector] * len(vector_chunk)),
-        vector_chunk,
-        strict=True,
-    )[1]
+    state = get_worker_session_state(session, lambda data: dict())
+    gradient_graph = state.get("gradient_graph")
+    if gradient_graph is None:
+        data = session.data
+        gradient_graph, graph_bytes = get_gradient_graph_and_size(
+            data["model_with_loss"],
+            data["parameter_vector"].to(worker_device),
+            data["param_shape_dict"],
+            put_data_to_device(data["inputs"], worker_device),
+            put_data_to_device(data["targets"], worker_device),
+        )
+        if state.get("cacheable", True):
+            state["cacheable"] = can_cache_graph(
+                graph_bytes, data["max_cached_graph_bytes"]
+            )
+        if state["cacheable"]:
+            state["gradient_graph"] = gradient_graph
+    products = get_products_from_gradient_graph(
+        *gradient_graph,
+        [vector.to(worker_device) for vector in vector_chunk],
+        retain_graph=state["cacheable"],
+    )
     return (idx, products)
 
 
@@ -125,37 +175,57 @@ def __exit_handler():
 atexit.register(__exit_handler)
 
 
-def get_hessian_vector_product_func(model_with_loss: ModelWithLoss, batch):
-    # get all parameters and names
-    params = []
-    param_shape_dict = dict()
-    devices = get_cuda_devices()
-
-    model = ModelUtil(model_with_loss.model).deepcopy()
-    if ModelUtil(model).is_pruned:
-        ModelUtil(model).merge_and_remove_masks()
-    model.zero_grad()
-    model.share_memory()
-
-    model_snapshot = ModelSnapshot.resize_and_get(model, devices[0], 1)[0]
-
-    for name, param in model.named_parameters():
-        params.append(copy.deepcopy(param).detach())
-        param_shape_dict[name] = param.shape
-
-    parameter_snapshot = cat_tensors_to_vector(params)
-
-    inputs_dict = dict()
-    targets_dict = dict()
-    parameter_dict = dict()
-
-    for device in devices:
-        inputs_dict[str(device)] = copy.deepcopy(batch[0]).to(device)
-        targets_dict[str(device)] = copy.deepcopy(batch[1]).to(device)
-        parameter_dict[str(device)] = copy.deepcopy(parameter_snapshot).to(device)
-
-    def vhp_func(v):
-        global task_queue
+class HessianVectorProductFunction:
+    r"""
+    Compute Hessian-vector products of a batch.
+    When cache_graph is set, the gradient graph is built once in this process and later products only need a double-backward.
+    Otherwise the model and the batch are shared with the workers through a session, and each worker keeps its own gradient graph of the session.
+    The graphs, including those of the workers, are dropped by release() or not cached at all if their saved tensors take more than max_cached_graph_bytes.
+    """
+
+    def __init__(
+        self,
+        model_with_loss: ModelWithLoss,
+        batch,
+        cache_graph: bool = False,
+        max_cached_graph_bytes=None,
+    ):
+        # get all parameters and names
+        params = []
+        self.__param_shape_dict: dict = dict()
+        self.__devices = get_devices()
+        self.__loss_fun = model_with_loss.loss_fun
+
+        model = ModelUtil(model_with_loss.model).deepcopy()
+        if ModelUtil(model).is_pruned:
+            ModelUtil(model).merge_and_remove_masks()
+        model.zero_grad()
+        model.share_memory()
+
+        self.__model_snapshot = ModelSnapshot.resize_and_get(
+            model, self.__devices[0], 1
+        )[0]
+
+        for name, param in model.named_parameters():
+            params.append(copy.deepcopy(param).detach())
+            self.__param_shape_dict[name] = param.shape
+
+        self.__parameter_snapshot = cat_tensors_to_vector(params)
+        self.__inputs = copy.deepcopy(batch[0])
+        self.__targets = copy.deepcopy(batch[1])
+        self.__session = None
+
+        self.__cache_graph = cache_graph
+        self.__max_cached_graph_bytes = max_cached_graph_bytes
+        self.__gradient_graph = None
+
+    def release(self):
+        self.__gradient_graph = None
+        if self.__session is not None and task_queue is not None:
+            task_queue.release_worker_sessions()
+        self.__session = None
+
+    def __call__(self, v):
         v_is_tensor = False
         if isinstance(v, list):
             vectors = v
@@ -165,6 +235,39 @@ def get_hessian_vector_product_func(model_with_loss: ModelWithLoss, batch):
             v_is_tensor = True
             vectors = [v]
 
+        if self.__cache_graph and self.__gradient_graph is None:
+            self.__build_gradient_graph()
+        if self.__gradient_graph is not None:
+            device = self.__devices[0]
+            products = get_products_from_gradient_graph(
+                *self.__gradient_graph,
+                [vector.to(device) for vector in vectors],
+                retain_graph=True,
+            )
+        else:
+            products = self.__compute_by_workers(vectors)
+        assert len(products) == len(vectors)
+        if v_is_tensor:
+            return products[0]
+        return [p.to(self.__devices[0]) for p in products]
+
+    def __build_gradient_graph(self):
+        device = self.__devices[0]
+        gradient_graph, graph_bytes = get_gradient_graph_and_size(
+            ModelWithLoss(copy.deepcopy(self.__model_snapshot), self.__loss_fun),
+            self.__parameter_snapshot.to(device),
+            self.__param_shape_dict,
+            put_data_to_device(copy.deepcopy(self.__inputs), device),
+            put_data_to_device(copy.deepcopy(self.__targets), device),
+        )
+        if not can_cache_graph(graph_bytes, self.__max_cached_graph_bytes):
+            self.__cache_graph = False
+            return
+        self.__gradient_graph = gradient_graph
+
+    def __compute_by_workers(self, vectors: list) -> list:
+        global task_queue
+        devices = self.__devices
         vector_chunks = list(
             split_list_to_chunks(
                 vectors, (len(vectors) + len(devices) - 1) // len(devices)
@@ -172,21 +275,21 @@ def get_hessian_vector_product_func(model_with_loss: ModelWithLoss, batch):
         )
         assert len(vector_chunks) <= len(devices)
 
+        if self.__session is None:
+            self.__session = WorkerSession(
+                model_with_loss=ModelWithLoss(self.__model_snapshot, self.__loss_fun),
+                parameter_vector=self.__parameter_snapshot,
+                param_shape_dict=self.__param_shape_dict,
+                inputs=self.__inputs,
+                targets=self.__targets,
+                max_cached_graph_bytes=self.__max_cached_graph_bytes,
+            )
+
         if task_queue is None:
-            task_queue = CUDAProcessTaskQueue(worker_fun)
+            task_queue = TorchProcessTaskQueue(worker_fun)
         task_queue.start()
         for idx, vector_chunk in enumerate(vector_chunks):
-            task_queue.add_task(
-                (
-                    idx,
-                    vector_chunk,
-                    ModelWithLoss(model_snapshot, model_with_loss.loss_fun),
-                    parameter_dict,
-                    inputs_dict,
-                    targets_dict,
-                    param_shape_dict,
-                )
-            )
+            task_queue.add_task((idx, vector_chunk, self.__session))
 
         total_products = dict()
         for _ in range(len(vector_chunks)):
@@ -196,9 +299,18 @@ def get_hessian_vector_product_func(model_with_loss: ModelWithLoss, batch):
         products = []
         for idx in sorted(total_products.keys()):
             products += total_products[idx]
-        assert len(products) == len(vectors)
-        if v_is_tensor:
-            return products[0]
-        return [p.to(devices[0]) for p in products]
+        return products
+
 
-    return vhp_func
+def get_hessian_vector_product_func(
+    model_with_loss: ModelWithLoss,
+    batch,
+    cache_graph: bool = False,
+    max_cached_graph_bytes=None,
+) -> HessianVectorProductFunction:
+    return HessianVectorProductFunction(
+        model_with_loss,
+        batch,
+        cache_graph=cache_graph,
+        max_cached_graph_bytes=max_cached_graph_bytes,
+    )
@@ -101,7 +101,7 @@ class HyperGradientAnalyzer:
         return contribution_dict
 
     def get_test_gradients(self, test_subset_dict: dict):
-        tmp_inferencer = copy.deepcopy(self.inferencer)
+        tmp_inferencer = copy.copy(self.inferencer)
         for test_key, indices in test_subset_dict.items():
             subset = sub_dataset(self.inferencer.dataset, indices)
             assert len(subset) == len(indices)
@@ -10,7 +10,10 @@ from cyy_naive_lib.log import get_logger
 from cyy_naive_lib.time_counter import TimeCounter
 
 from algorithm.hessian_vector_product import get_hessian_vector_product_func
-from algorithm.per_sample_gradient import get_per_sample_gradient
+from algorithm.per_sample_gradient import (
+    get_batched_per_sample_gradient,
+    get_per_sample_gradient,
+)
 from model_util import ModelUtil
 
 
@@ -65,6 +68,9 @@ class HyperGradientTrainer:
         else:
             self.hessian_hyper_gradient_mom_dict = None
         self.hvp_function = None
+        self.use_batched_per_sample_gradient = kwargs.get(
+            "use_batched_per_sample_gradient", False
+        )
 
         self.use_approximation = kwargs.get("use_approximation", None)
         if self.use_approximation is None:
@@ -338,7 +344,7 @@ class HyperGradientTrainer:
         m.set_logging(False)
         return m
 
-    def __pre_batch_callback(self, trainer, batch_index, batch):
+    def __pre_batch_callback(self, trainer, batch_index, batch, **kwargs):
         assert len(batch) >= 3
         batch_gradient_indices = [idx.data.item() for idx in batch[2]]
         if self.computed_indices is not None:
@@ -346,9 +352,10 @@ class HyperGradientTrainer:
 
         self.batch_gradients.clear()
 
-        instance_inputs, instance_targets, instance_indices = trainer.decode_batch(
-            batch
-        )
+        decoded_batch = kwargs.get("decoded_batch")
+        if decoded_batch is None:
+            decoded_batch = trainer.decode_batch(batch)
+        instance_inputs, instance_targets, instance_indices = decoded_batch
         sample_gradient_inputs = []
         sample_gradient_targets = []
         sample_gradient_indices = []
@@ -363,11 +370,18 @@ class HyperGradientTrainer:
             sample_gradient_inputs.append(instance_input)
             sample_gradient_targets.append(instance_target)
             sample_gradient_indices.append(instance_index)
-        gradient_list = get_per_sample_gradient(
-            trainer.model_with_loss,
-            sample_gradient_inputs,
-            sample_gradient_targets,
-        )
+        if self.use_batched_per_sample_gradient:
+            gradient_list = get_batched_per_sample_gradient(
+                trainer.model_with_loss,
+                sample_gradient_inputs,
+                sample_gradient_targets,
+            )
+        else:
+            gradient_list = get_per_sample_gradient(
+                trainer.model_with_loss,
+                sample_gradient_inputs,
+                sample_gradient_targets,
+            )
 
         assert len(gradient_list) == len(sample_gradient_indices)
         for (sample_gradient, index) in zip(gradient_list, sample_gradient_indices):
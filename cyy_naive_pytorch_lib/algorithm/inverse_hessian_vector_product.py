@@ -82,5 +82,9 @@ def conjugate_gradient_inverse_hessian_vector_product(
 ):
     data_loader = torch.utils.data.DataLoader(dataset, batch_size=len(dataset))
     for batch in data_loader:
-        hvp_function = get_hessian_vector_product_func(model_with_loss, batch)
-        return conjugate_gradient_general(hvp_function, v, max_iteration)
+        hvp_function = get_hessian_vector_product_func(
+            model_with_loss, batch, cache_graph=True
+        )
+        product = conjugate_gradient_general(hvp_function, v, max_iteration)
+        hvp_function.release()
+        return product
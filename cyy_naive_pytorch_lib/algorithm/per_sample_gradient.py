@@ -6,24 +6,36 @@ import copy
 import torch
 from cyy_naive_lib.algorithm.sequence_op import split_list_to_chunks
 
-from data_structure.cuda_process_task_queue import CUDAProcessTaskQueue
-from device import get_cuda_devices
+from data_structure.torch_process_task_queue import (
+    TorchProcessTaskQueue,
+    WorkerSession,
+    get_worker_session_state,
+)
+from device import get_devices
 from ml_types import MachineLearningPhase
 from model_loss import ModelWithLoss
 from model_util import ModelUtil
 
 
+def __prepare_session(data: dict, device):
+    model_with_loss = data["model_with_loss"]
+    model_with_loss.model.to(device)
+    return (model_with_loss, data["inputs"].to(device), data["targets"].to(device))
+
+
 def __worker_fun(task, args):
-    (index, input_chunk, target_chunk, model_with_loss, master_device) = task
+    (index, session, sample_indices, master_device) = task
 
     loss = None
     device = args[0]
-    model_with_loss.model.to(device)
+    model_with_loss, inputs, targets = get_worker_session_state(
+        session, lambda data: __prepare_session(data, device)
+    )
     gradient_lists = []
-    for (sample_input, sample_target) in zip(input_chunk, target_chunk):
+    for sample_index in sample_indices:
         model_with_loss.model.zero_grad()
-        sample_input = torch.stack([sample_input]).to(device)
-        sample_target = torch.stack([sample_target]).to(device)
+        sample_input = inputs[sample_index : sample_index + 1]
+        sample_target = targets[sample_index : sample_index + 1]
         loss = model_with_loss(
             sample_input, sample_target, MachineLearningPhase.Training
         )["loss"]
@@ -31,10 +43,60 @@ def __worker_fun(task, args):
         gradient_lists.append(
             ModelUtil(model_with_loss.model).get_gradient_list().to(master_device)
         )
-    assert len(gradient_lists) == len(input_chunk)
+    assert len(gradient_lists) == len(sample_indices)
     return (index, gradient_lists)
 
 
+def get_batched_per_sample_gradient(
+    model_with_loss: ModelWithLoss, inputs, targets, chunk_size=None
+) -> torch.Tensor:
+    r"""
+    Compute the gradients of all samples in one vectorized forward and backward pass.
+    Row i of the returned matrix is the gradient of sample i, and its columns follow the order of ModelUtil.get_parameter_list.
+    In training mode, random operations such as dropout are independent among samples.
+    """
+    assert model_with_loss.loss_fun.reduction in ("mean", "elementwise_mean")
+    assert len(inputs) == len(targets)
+
+    model = model_with_loss.model
+    assert not ModelUtil(model).is_pruned
+    if ModelUtil(model).has_sub_module(torch.nn.modules.batchnorm._BatchNorm):
+        # running statistics can't be updated in place inside vmap
+        model = copy.deepcopy(model)
+        torch.func.replace_all_batch_norm_modules_(model)
+
+    if isinstance(inputs, list):
+        inputs = torch.stack(inputs)
+    if isinstance(targets, list):
+        targets = torch.stack(targets)
+
+    parameter_dict = {k: v.detach() for k, v in model.named_parameters()}
+    buffer_dict = {k: v.detach() for k, v in model.named_buffers()}
+    device = next(iter(parameter_dict.values())).device
+    loss_fun = model_with_loss.loss_fun
+
+    def sample_loss(parameters, sample_input, sample_target):
+        output = torch.func.functional_call(
+            model, (parameters, buffer_dict), (sample_input.unsqueeze(0),)
+        )
+        return loss_fun(output, sample_target.unsqueeze(0))
+
+    # each sample draws its own dropout mask as in a separate forward pass
+    gradient_dict = torch.func.vmap(
+        torch.func.grad(sample_loss),
+        in_dims=(None, 0, 0),
+        randomness="different",
+        chunk_size=chunk_size,
+    )(parameter_dict, inputs.to(device), targets.to(device))
+    return torch.cat(
+        [
+            gradient_dict[name].reshape(len(inputs), -1)
+            for name in sorted(gradient_dict.keys())
+        ],
+        dim=1,
+    )
+
+
 __task_queue = None
 
 
@@ -57,34 +119,33 @@ def get_per_sample_gradient(model_with_loss: ModelWithLoss, inputs, targets):
     # if ModelUtil(model).is_pruned:
     #     ModelUtil(model).merge_and_remove_masks()
     model.zero_grad()
-    model.share_memory()
-
-    devices = get_cuda_devices()
-    master_device = devices[0]
 
-    input_chunks = list(
-        split_list_to_chunks(inputs, (len(inputs) + len(devices) - 1) // len(devices))
+    if isinstance(inputs, list):
+        inputs = torch.stack(inputs)
+    if isinstance(targets, list):
+        targets = torch.stack(targets)
+    session = WorkerSession(
+        model_with_loss=ModelWithLoss(model, model_with_loss.loss_fun),
+        inputs=inputs.detach().cpu().clone(),
+        targets=targets.detach().cpu().clone(),
     )
 
-    target_chunks = list(
-        split_list_to_chunks(targets, (len(targets) + len(devices) - 1) // len(devices))
+    devices = get_devices()
+    master_device = devices[0]
+
+    index_chunks = list(
+        split_list_to_chunks(
+            list(range(len(inputs))), (len(inputs) + len(devices) - 1) // len(devices)
+        )
     )
     if __task_queue is None:
-        __task_queue = CUDAProcessTaskQueue(__worker_fun)
+        __task_queue = TorchProcessTaskQueue(__worker_fun)
     __task_queue.start()
-    for idx, (input_chunk, target_chunk) in enumerate(zip(input_chunks, target_chunks)):
-        __task_queue.add_task(
-            (
-                idx,
-                input_chunk,
-                target_chunk,
-                ModelWithLoss(copy.deepcopy(model), model_with_loss.loss_fun),
-                master_device,
-            )
-        )
+    for idx, index_chunk in enumerate(index_chunks):
+        __task_queue.add_task((idx, session, index_chunk, master_device))
 
     gradient_dict = dict()
-    for _ in range(len(input_chunks)):
+    for _ in range(len(index_chunks)):
         idx, gradient_list = __task_queue.get_result()
         gradient_dict[idx] = gradient_list
 
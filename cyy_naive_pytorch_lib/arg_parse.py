@@ -9,12 +9,20 @@ import torch
 from cyy_naive_lib.log import get_logger
 
 from configuration import get_trainer_from_configuration
+from data_pruning import prune_training_dataset
+from dataloader_tuner import tune_dataloader
 from dataset import (DatasetUtil, get_dataset, replace_dataset_labels,
                      sub_dataset)
 from hyper_parameter import HyperParameter
+from hyper_parameter_finder import find_hyper_parameter
 from inference import Inferencer
 from ml_types import MachineLearningPhase
 from reproducible_env import global_reproducible_env
+from stop_criterion import (
+    TargetAccuracyCriterion,
+    TimeBudgetCriterion,
+    ValidationLossPatienceCriterion,
+)
 from trainer import Trainer
 
 
@@ -25,11 +33,17 @@ def get_arg_parser():
     parser.add_argument("--learning_rate_scheduler", type=str, default=None)
     parser.add_argument("--epoch", type=int, default=None)
     parser.add_argument("--batch_size", type=int, default=None)
+    parser.add_argument("--scale_batch_size", type=int, default=None)
     parser.add_argument("--learning_rate", type=float, default=None)
     parser.add_argument("--optimizer", type=str, default=None)
     parser.add_argument("--momentum", type=float, default=None)
     parser.add_argument("--weight_decay", type=float, default=None)
+    parser.add_argument(
+        "--autocast_dtype", type=str, choices=["bfloat16"], default=None
+    )
     parser.add_argument("--stop_accuracy", type=float, default=None)
+    parser.add_argument("--stop_patience", type=int, default=None)
+    parser.add_argument("--time_budget", type=float, default=None)
     parser.add_argument("--model_path", type=str, default=None)
     parser.add_argument("--save_dir", type=str, default=None)
     parser.add_argument("--reproducible_env_load_path", type=str, default=None)
@@ -37,7 +51,19 @@ def get_arg_parser():
     parser.add_argument("--training_dataset_percentage", type=float, default=None)
     parser.add_argument("--randomized_label_map_path", type=str, default=None)
     parser.add_argument("--training_dataset_indices_path", type=str, default=None)
+    parser.add_argument("--pruning_fraction", type=float, default=None)
+    parser.add_argument("--pruning_warm_up_epoch", type=int, default=10)
+    parser.add_argument(
+        "--pruning_score_type",
+        type=str,
+        choices=["el2n", "loss", "forgetting"],
+        default="el2n",
+    )
     parser.add_argument("--logger_level", type=str, default=None)
+    parser.add_argument("--tune_dataloader", action="store_true", default=False)
+    parser.add_argument("--find_hyper_parameter", action="store_true", default=False)
+    parser.add_argument("--compile_model", action="store_true", default=False)
+    parser.add_argument("--channels_last", action="store_true", default=False)
     return parser
 
 
@@ -90,6 +116,8 @@ def create_trainer_from_args(args) -> Trainer:
         hyper_parameter.set_momentum(args.momentum)
     if args.weight_decay is not None:
         hyper_parameter.set_weight_decay(args.weight_decay)
+    if args.autocast_dtype is not None:
+        hyper_parameter.set_autocast_dtype(getattr(torch, args.autocast_dtype))
     if args.optimizer is not None:
         hyper_parameter.set_optimizer_factory(
             HyperParameter.get_optimizer_factory(args.optimizer)
@@ -98,13 +126,44 @@ def create_trainer_from_args(args) -> Trainer:
         hyper_parameter.set_lr_scheduler_factory(
             HyperParameter.get_lr_scheduler_factory(args.learning_rate_scheduler)
         )
+    if args.scale_batch_size is not None:
+        # the warmup schedule is used unless another lr scheduler is given
+        hyper_parameter.scale_batch_size(
+            args.scale_batch_size,
+            use_warmup_lr_scheduler=args.learning_rate_scheduler is None,
+        )
     trainer.set_hyper_parameter(hyper_parameter)
+    if args.compile_model:
+        trainer.model_with_loss.set_compiled(True)
+    if args.channels_last:
+        trainer.model_with_loss.set_channels_last(True)
+    if args.find_hyper_parameter:
+        find_hyper_parameter(
+            trainer, dataset_name=args.dataset_name, model_name=args.model_name
+        )
+    if args.tune_dataloader:
+        tune_dataloader(trainer, args.dataset_name)
+
+    if args.pruning_fraction is not None:
+        kept_indices = prune_training_dataset(
+            trainer,
+            args.pruning_fraction,
+            args.pruning_warm_up_epoch,
+            args.pruning_score_type,
+        )
+        os.makedirs(args.save_dir, exist_ok=True)
+        with open(
+            os.path.join(args.save_dir, "pruned_training_dataset_indices.json"),
+            mode="wt",
+        ) as f:
+            json.dump(kept_indices, f)
 
     if args.stop_accuracy is not None:
-        trainer.set_stop_criterion(
-            lambda trainer, epoch, __: trainer.validation_accuracy[epoch]
-            >= args.stop_accuracy
-        )
+        trainer.add_stop_criterion(TargetAccuracyCriterion(args.stop_accuracy))
+    if args.stop_patience is not None:
+        trainer.add_stop_criterion(ValidationLossPatienceCriterion(args.stop_patience))
+    if args.time_budget is not None:
+        trainer.add_stop_criterion(TimeBudgetCriterion(args.time_budget))
     return trainer
 
 
@@ -1,17 +1,37 @@
 import copy
-import logging
 import os
+import time
 from typing import Callable, List, Optional
 
 import torch
 from cyy_naive_lib.log import get_logger
 
+from checkpoint import (
+    CheckpointWriter,
+    copy_to_cpu,
+    get_random_states,
+    load_checkpoint,
+    set_random_states,
+)
+from data_structure.batch_echoer import BatchEchoer
+from data_structure.batch_prefetcher import BatchPrefetcher
 from device import get_device, put_data_to_device
-from hyper_parameter import HyperParameter
+from distributed import (
+    GradientAllReducer,
+    all_reduce_sum,
+    broadcast_model,
+    broadcast_tensor,
+    get_world_size,
+    is_distributed,
+    is_main_process,
+)
+from hyper_parameter import HyperParameter, LinearWarmupLR
 from inference import ClassificationInferencer, DetectionInferencer, Inferencer
 from ml_types import MachineLearningPhase, ModelType
 from model_loss import ModelWithLoss
-from tensor import get_batch_size
+from phase_timer import PhaseTimer, get_callback_name
+from repeated_training import run_repeated_training
+from tensor import get_batch_size, split_batch
 
 
 class BasicTrainer:
@@ -29,10 +49,13 @@ class BasicTrainer:
         self.__device = get_device()
         self.__data: dict = dict()
         self.__callbacks: dict[str, List[Callable]] = dict()
+        self.__evaluation_replicas: dict = dict()
+        self.__phase_timer = PhaseTimer()
         self.__clear_loss()
+        # use the trainer argument instead of self so that copies of the trainer set their own data
         self.add_callback(
             "pre_batch_callbacks",
-            lambda trainer, batch, batch_index: self.set_data(
+            lambda trainer, batch_index, batch, **kwargs: trainer.set_data(
                 "cur_learning_rates",
                 [group["lr"] for group in trainer.get_optimizer().param_groups],
             ),
@@ -92,33 +115,61 @@ class BasicTrainer:
     def get_inferencer(
         self, phase: MachineLearningPhase, copy_model=True
     ) -> Inferencer:
+        r"""
+        If copy_model is set, the inferencer uses an evaluation replica of this phase instead of the training model.
+        The replica is created once and only gets the current weights and modes on later calls,
+        so inferencers of the same phase share it.
+        """
         assert phase != MachineLearningPhase.Training
 
         dataset = self.validation_dataset
         if phase == MachineLearningPhase.Test:
             dataset = self.test_dataset
+        model_with_loss = self.model_with_loss
+        if copy_model:
+            model_with_loss = self.__get_evaluation_replica(phase)
         if self.model_with_loss.model_type == ModelType.Classification:
             return ClassificationInferencer(
-                self.model_with_loss,
+                model_with_loss,
                 dataset,
                 phase=phase,
                 hyper_parameter=self.hyper_parameter,
-                copy_model=copy_model,
+                copy_model=False,
                 device=self.device,
             )
         if self.model_with_loss.model_type == ModelType.Detection:
             return DetectionInferencer(
-                self.model_with_loss,
+                model_with_loss,
                 dataset,
                 phase=phase,
                 hyper_parameter=self.hyper_parameter,
                 iou_threshold=0.6,
-                copy_model=copy_model,
+                copy_model=False,
                 device=self.device,
             )
         assert False
         return None
 
+    def __get_evaluation_replica(self, phase: MachineLearningPhase) -> ModelWithLoss:
+        replica = self.__evaluation_replicas.get(phase)
+        if replica is not None and replica[0] is self.model:
+            try:
+                # the modes may have changed since the replica was copied
+                if replica[1].compiled != self.model_with_loss.compiled:
+                    replica[1].set_compiled(self.model_with_loss.compiled)
+                if replica[1].channels_last != self.model_with_loss.channels_last:
+                    replica[1].set_channels_last(self.model_with_loss.channels_last)
+                with torch.no_grad():
+                    replica[1].model.load_state_dict(self.model.state_dict())
+                return replica[1]
+            except RuntimeError:
+                # the structure of the model has changed, for example by pruning
+                get_logger().debug("recreate evaluation replica for %s", phase)
+        get_logger().debug("copy model for evaluation replica of %s", phase)
+        replica = (self.model, copy.deepcopy(self.model_with_loss))
+        self.__evaluation_replicas[phase] = replica
+        return replica[1]
+
     def set_hyper_parameter(self, hyper_parameter):
         self.__hyper_parameter = hyper_parameter
 
@@ -141,11 +192,20 @@ class BasicTrainer:
             self.set_data(
                 "lr_scheduler",
                 self.hyper_parameter.get_lr_scheduler(
-                    self.get_optimizer(), self.get_data("training_set_size")
+                    self.get_optimizer(),
+                    # each process only iterates over its part of the training set
+                    -(-self.get_data("training_set_size") // get_world_size()),
                 ),
             )
         return self.get_data("lr_scheduler")
 
+    def remove_optimizer(self):
+        r"""
+        Drop the optimizer and the lr scheduler so that the next training creates them again.
+        """
+        self.__data.pop("optimizer", None)
+        self.__data.pop("lr_scheduler", None)
+
     def set_model(self, model: torch.nn.Module):
         self.model_with_loss.set_model(model)
 
@@ -156,15 +216,28 @@ class BasicTrainer:
         os.makedirs(save_dir, exist_ok=True)
         torch.save(self.model, os.path.join(save_dir, model_name))
 
-    def repeated_train(self, repeated_num, save_dir=None, **kwargs):
-        def training_callback(_, trainer: BasicTrainer):
-            nonlocal save_dir, kwargs
-            get_logger().setLevel(logging.ERROR)
+    def repeated_train(
+        self,
+        repeated_num,
+        save_dir=None,
+        worker_num=None,
+        result_callback=None,
+        with_variance=False,
+        deterministic=False,
+        **kwargs,
+    ):
+        r"""
+        Train repeated_num copies of this trainer with different seeds in parallel processes, see repeated_training.run_repeated_training.
+        Return the mean of each statistic, or a pair of the means and the variances if with_variance is set.
+        """
+
+        def training_callback(run_idx, trainer: BasicTrainer):
+            # each run starts with a new optimizer instead of the state left by previous training
+            trainer.remove_optimizer()
             kwargs["test_epoch_interval"] = 1
             trainer.train(**kwargs)
             if save_dir is not None:
-                trainer.save_model(save_dir)
-            get_logger().setLevel(logging.DEBUG)
+                trainer.save_model(os.path.join(save_dir, str(run_idx)))
             return {
                 "training_loss": trainer.training_loss,
                 "validation_loss": trainer.validation_loss,
@@ -173,85 +246,295 @@ class BasicTrainer:
                 "test_accuracy": trainer.test_accuracy,
             }
 
-        return BasicTrainer.__repeated_training(repeated_num, self, training_callback)
+        return run_repeated_training(
+            repeated_num,
+            self,
+            training_callback,
+            worker_num=worker_num,
+            result_callback=result_callback,
+            with_variance=with_variance,
+            deterministic=deterministic,
+        )
+
+    def resume_from(self, checkpoint_dir: str):
+        r"""
+        Load a checkpoint written by train(checkpoint_dir=...), the next call of train() continues from the saved epoch and batch.
+        The random states are restored too, but persistent dataloader workers keep their own seeds,
+        so the result is only bit-for-bit identical to an uninterrupted run when the dataloader has no workers.
+        """
+        state = load_checkpoint(checkpoint_dir)
+        self.set_data("training_set_size", len(self.training_dataset))
+        self.model.load_state_dict(state["model_state_dict"])
+        # the optimizer state should be on the same device as the parameters
+        self.model.to(self.device)
+        # creating the lr scheduler changes the learning rates, so it must come before loading the optimizer
+        lr_scheduler = self.get_lr_scheduler()
+        self.get_optimizer().load_state_dict(state["optimizer_state_dict"])
+        lr_scheduler.load_state_dict(state["lr_scheduler_state_dict"])
+        self.training_loss = state["training_loss"]
+        self.validation_loss = state["validation_loss"]
+        self.validation_accuracy = state["validation_accuracy"]
+        self.test_loss = state["test_loss"]
+        self.test_accuracy = state["test_accuracy"]
+        self.set_data("resume_state", state)
+        get_logger().info(
+            "resume from epoch %s batch %s", state["epoch"], state["batch_index"]
+        )
 
     def train(self, **kwargs):
+        r"""
+        If checkpoint_dir is set, a checkpoint is written there in the background after each epoch,
+        and also every checkpoint_batch_interval batches if it is set.
+        In data parallel training, only the process of rank 0 writes checkpoints.
+        The batch_loss passed to after_batch_callbacks is a tensor on the device, callbacks should only call item() on it when they need the value.
+        The batch_output passed to them is the detached output of the model for the batch, or None if the model has no output tensor.
+        The wall time of each phase of a batch and of each callback is summarized per epoch in get_data("phase_time_statistics"),
+        which is also passed to the phase_time_callbacks.
+        After each epoch the stop criteria are checked, and after_training_callbacks are called with the last epoch.
+        If data_echo_num or max_data_echo_num is set, each batch is trained data_echo_num times, or an adaptive number of times up to max_data_echo_num,
+        by a BatchEchoer with data_echo_fun. The echoes share the batch and batch_index passed to callbacks,
+        and only the first echo counts in the training loss and steps the lr scheduler.
+        Adaptive echoing is not supported in data parallel training since processes must train the same number of steps.
+        """
+        if is_distributed() and kwargs.get("max_data_echo_num") is not None:
+            raise RuntimeError("use data_echo_num in data parallel training")
+        if self.hyper_parameter.autocast_dtype == torch.float16:
+            raise RuntimeError(
+                "training with float16 autocast is not supported, use bfloat16"
+            )
+        checkpoint_writer = None
+        if kwargs.get("checkpoint_dir") is not None and is_main_process():
+            checkpoint_writer = CheckpointWriter(kwargs["checkpoint_dir"])
+        gradient_all_reducer = None
+        if is_distributed():
+            self.model.to(self.device)
+            broadcast_model(self.model)
+            gradient_all_reducer = GradientAllReducer(self.model)
+        try:
+            self.__train(checkpoint_writer, gradient_all_reducer, **kwargs)
+        finally:
+            if checkpoint_writer is not None:
+                checkpoint_writer.close()
+            if gradient_all_reducer is not None:
+                gradient_all_reducer.remove()
+
+    def __train(
+        self,
+        checkpoint_writer: Optional[CheckpointWriter],
+        gradient_all_reducer: Optional[GradientAllReducer],
+        **kwargs,
+    ):
         training_set_size = len(self.training_dataset)
         self.set_data("training_set_size", training_set_size)
         get_logger().info("training_set_size is %s", training_set_size)
         get_logger().info("use device %s", self.device)
-        self.__clear_loss()
+        resume_state = self.__data.pop("resume_state", None)
+        start_epoch = 1
+        if resume_state is None:
+            self.__clear_loss()
+        else:
+            start_epoch = resume_state["epoch"]
+        micro_batch_num = kwargs.get("micro_batch_num", 1)
+        assert micro_batch_num >= 1
+        checkpoint_batch_interval = kwargs.get("checkpoint_batch_interval")
+        self.set_data("training_start_time", time.time())
+        self.set_data("training_start_epoch", start_epoch)
 
         for callback in self.get_callbacks("pre_training_callbacks"):
             callback(self)
-        for epoch in range(1, self.hyper_parameter.epoch + 1):
+        epoch = start_epoch - 1
+        for epoch in range(start_epoch, self.hyper_parameter.epoch + 1):
             optimizer = self.get_optimizer()
             lr_scheduler = self.get_lr_scheduler()
             assert optimizer is not None
             assert lr_scheduler is not None
-            training_loss = 0.0
-            for batch_index, batch in enumerate(
-                self.__hyper_parameter.get_dataloader(
-                    self.training_dataset, phase=MachineLearningPhase.Training
-                )
+            training_loss = torch.zeros(1, device=self.device)
+            skipped_batch_num = 0
+            random_states = None
+            if resume_state is not None:
+                # replay the sampling of the interrupted epoch and skip the trained batches
+                set_random_states(resume_state["epoch_random_states"])
+                skipped_batch_num = resume_state["batch_index"]
+                random_states = resume_state["random_states"]
+                if is_main_process():
+                    # the saved loss is already summed over all processes
+                    training_loss += resume_state["epoch_training_loss"]
+                resume_state = None
+            epoch_random_states = None
+            if checkpoint_writer is not None:
+                epoch_random_states = get_random_states()
+            dataloader = self.__hyper_parameter.get_dataloader(
+                self.training_dataset, phase=MachineLearningPhase.Training
+            )
+            if isinstance(
+                dataloader.sampler, torch.utils.data.distributed.DistributedSampler
+            ):
+                dataloader.sampler.set_epoch(epoch)
+            # skipped batches are loaded to replay the random state but not decoded
+            batch_prefetcher = BatchPrefetcher(
+                dataloader,
+                depth=kwargs.get("prefetch_depth", 0),
+                decode_fun=self.decode_batch,
+                skipped_batch_num=skipped_batch_num,
+                random_states=random_states,
+            )
+            batch_echoer = BatchEchoer(
+                batch_prefetcher,
+                decode_fun=self.decode_batch,
+                echo_num=kwargs.get(
+                    "data_echo_num",
+                    None if kwargs.get("max_data_echo_num") is not None else 1,
+                ),
+                max_echo_num=kwargs.get("max_data_echo_num", 1),
+                echo_fun=kwargs.get("data_echo_fun"),
+                start_batch_index=skipped_batch_num,
+            )
+            if (
+                kwargs.get("data_echo_num") is None
+                and kwargs.get("max_data_echo_num") is not None
+                and epoch > start_epoch
             ):
+                # continue adapting from the last epoch
+                batch_echoer.echo_num = self.get_data("data_echo_num")
+            phase_timer = self.__phase_timer
+            phase_timer.reset()
+            batch_end_time = time.perf_counter()
+            for batch_index, echo_index, batch, decoded_batch in batch_echoer:
+                batch_start_time = time.perf_counter()
+                phase_timer.record("data", batch_start_time - batch_end_time)
                 self.model_with_loss.set_model_mode(MachineLearningPhase.Training)
                 self.model.to(self.device)
                 optimizer.zero_grad()
                 self.set_data(
                     "learning_rates", [group["lr"] for group in optimizer.param_groups]
                 )
-                for callback in self.get_callbacks("pre_batch_callbacks"):
-                    callback(self, batch_index, batch)
-
-                instance_inputs, instance_targets, _ = self.decode_batch(batch)
-                optimizer.zero_grad()
-                result = self.model_with_loss(
-                    instance_inputs,
-                    instance_targets,
-                    phase=MachineLearningPhase.Training,
+                self.__call_callbacks(
+                    "pre_batch_callbacks",
+                    self,
+                    batch_index,
+                    batch,
+                    decoded_batch=decoded_batch,
                 )
-                loss = result["loss"]
-                loss.backward()
-                batch_loss = loss.data.item()
-
-                normalized_batch_loss = batch_loss
-                if self.model_with_loss.is_averaged_loss():
-                    real_batch_size = get_batch_size(instance_inputs)
-                    normalized_batch_loss *= real_batch_size
-                normalized_batch_loss /= training_set_size
-                training_loss += normalized_batch_loss
-
-                callbacks = kwargs.get("optimizer_step_callbacks", [])
-                if callbacks:
-                    for callback in callbacks:
-                        callback(optimizer, trainer=self, device=self.device)
-                else:
-                    optimizer.step()
-                if HyperParameter.lr_scheduler_step_after_batch(lr_scheduler):
-                    get_logger().debug("adjust lr after batch")
-                    lr_scheduler.step()
 
-                for callback in self.get_callbacks("after_batch_callbacks"):
-                    callback(
-                        self,
-                        batch_index,
-                        batch=batch,
-                        epoch=epoch,
-                        batch_loss=batch_loss,
+                instance_inputs, instance_targets, _ = decoded_batch
+                optimizer.zero_grad()
+                real_batch_size = get_batch_size(instance_inputs)
+                self.set_data("cur_batch_size", real_batch_size)
+                # losses stay on the device until a host value is needed, so a batch needs no synchronization
+                batch_loss = torch.zeros(1, device=self.device)
+                micro_batch_outputs = []
+                micro_batches = list(
+                    zip(
+                        split_batch(instance_inputs, micro_batch_num),
+                        split_batch(instance_targets, micro_batch_num),
                     )
-
-            self.training_loss.append(training_loss)
-            for callback in self.get_callbacks("after_epoch_callbacks"):
-                callback(
+                )
+                for micro_batch_index, (
+                    micro_batch_inputs,
+                    micro_batch_targets,
+                ) in enumerate(micro_batches):
+                    if gradient_all_reducer is not None:
+                        # only reduce the accumulated gradients
+                        gradient_all_reducer.set_enabled(
+                            micro_batch_index + 1 == len(micro_batches)
+                        )
+                    with phase_timer.phase("forward"):
+                        result = self.model_with_loss(
+                            micro_batch_inputs,
+                            micro_batch_targets,
+                            phase=MachineLearningPhase.Training,
+                            autocast_dtype=self.hyper_parameter.autocast_dtype,
+                        )
+                        loss = result["loss"]
+                        if isinstance(result.get("output"), torch.Tensor):
+                            micro_batch_outputs.append(result["output"].detach())
+                        if self.model_with_loss.is_averaged_loss():
+                            # weight micro-batch means so that the gradients sum to the mean of the whole batch
+                            loss = loss * (
+                                get_batch_size(micro_batch_inputs) / real_batch_size
+                            )
+                    with phase_timer.phase("backward"):
+                        loss.backward()
+                        batch_loss += loss.detach()
+
+                if echo_index == 0:
+                    normalized_batch_loss = batch_loss
+                    if self.model_with_loss.is_averaged_loss():
+                        normalized_batch_loss = normalized_batch_loss * real_batch_size
+                    training_loss += normalized_batch_loss / training_set_size
+
+                if gradient_all_reducer is not None:
+                    with phase_timer.phase("gradient_all_reduce"):
+                        gradient_all_reducer.wait()
+                with phase_timer.phase("optimizer_step"):
+                    callbacks = kwargs.get("optimizer_step_callbacks", [])
+                    if callbacks:
+                        for callback in callbacks:
+                            callback(optimizer, trainer=self, device=self.device)
+                    else:
+                        optimizer.step()
+                    # echoes do not advance the schedule, whose length is counted in batches
+                    if echo_index == 0 and HyperParameter.lr_scheduler_step_after_batch(
+                        lr_scheduler
+                    ):
+                        get_logger().debug("adjust lr after batch")
+                        lr_scheduler.step()
+
+                batch_output = None
+                if len(micro_batch_outputs) == len(micro_batches):
+                    batch_output = torch.cat(micro_batch_outputs)
+                self.__call_callbacks(
+                    "after_batch_callbacks",
                     self,
-                    epoch,
-                    optimizer=optimizer,
-                    **kwargs,
+                    batch_index,
+                    batch=batch,
+                    epoch=epoch,
+                    batch_loss=batch_loss,
+                    batch_output=batch_output,
+                )
+                if (
+                    kwargs.get("checkpoint_dir") is not None
+                    and checkpoint_batch_interval
+                    and (batch_index + 1) % checkpoint_batch_interval == 0
+                    and echo_index + 1 == batch_echoer.echo_num
+                ):
+                    # all processes take part in the reduction
+                    epoch_training_loss = all_reduce_sum(training_loss).item()
+                    if checkpoint_writer is not None:
+                        self.__save_checkpoint(
+                            checkpoint_writer,
+                            epoch=epoch,
+                            batch_index=batch_index + 1,
+                            epoch_random_states=epoch_random_states,
+                            epoch_training_loss=epoch_training_loss,
+                        )
+                batch_end_time = time.perf_counter()
+                phase_timer.end_batch(
+                    real_batch_size, batch_end_time - batch_start_time
                 )
 
+            # each process only has the loss of its part of the training set
+            self.training_loss.append(all_reduce_sum(training_loss).item())
+            self.set_data("data_wait_time", batch_prefetcher.wait_time)
+            self.set_data("data_echo_num", batch_echoer.echo_num)
+            get_logger().info(
+                "epoch: %s, data wait time per batch: %s ms",
+                epoch,
+                1000 * batch_prefetcher.wait_time / max(batch_prefetcher.batch_num, 1),
+            )
+            self.__call_callbacks(
+                "after_epoch_callbacks",
+                self,
+                epoch,
+                optimizer=optimizer,
+                **kwargs,
+            )
+
             if not HyperParameter.lr_scheduler_step_after_batch(lr_scheduler):
-                if isinstance(lr_scheduler, torch.optim.lr_scheduler.ReduceLROnPlateau):
+                if isinstance(
+                    lr_scheduler,
+                    (torch.optim.lr_scheduler.ReduceLROnPlateau, LinearWarmupLR),
+                ):
                     get_logger().debug(
                         "call ReduceLROnPlateau for training loss %s",
                         self.training_loss[-1],
@@ -259,6 +542,118 @@ class BasicTrainer:
                     lr_scheduler.step(self.training_loss[-1])
                 else:
                     lr_scheduler.step()
+            self.__report_phase_time(epoch)
+            if checkpoint_writer is not None:
+                # the checkpoint includes the evaluation results of this epoch
+                self.wait_for_evaluation()
+                self.__save_checkpoint(
+                    checkpoint_writer,
+                    epoch=epoch + 1,
+                    batch_index=0,
+                    epoch_random_states=None,
+                    epoch_training_loss=0.0,
+                )
+            if self.__should_stop(epoch, kwargs):
+                break
+        for callback in self.get_callbacks("after_training_callbacks"):
+            callback(self, epoch, **kwargs)
+
+    def set_stop_criterion(self, criterion: Callable):
+        r"""
+        Replace the stop criteria by criterion, see stop_criterion.StopCriterion.
+        """
+        self.__callbacks["stop_criteria"] = [criterion]
+
+    def add_stop_criterion(self, criterion: Callable):
+        r"""
+        Training stops when any of the criteria is met.
+        """
+        self.add_callback("stop_criteria", criterion)
+
+    def wait_for_evaluation(self):
+        r"""
+        Subclasses that evaluate in the background wait here for the results.
+        """
+
+    def __should_stop(self, epoch: int, kwargs: dict) -> bool:
+        criteria = self.get_callbacks("stop_criteria")
+        if not criteria:
+            return False
+        stop = False
+        # only rank 0 has evaluation results in data parallel training
+        if is_main_process():
+            if any(
+                getattr(criterion, "needs_validation", False) for criterion in criteria
+            ):
+                self.wait_for_evaluation()
+            for criterion in criteria:
+                if criterion(self, epoch, kwargs):
+                    get_logger().warning(
+                        "stop training at epoch %s by %s",
+                        epoch,
+                        get_callback_name(criterion),
+                    )
+                    stop = True
+                    break
+        if is_distributed():
+            stop_tensor = torch.tensor([int(stop)])
+            broadcast_tensor(stop_tensor)
+            stop = bool(stop_tensor.item())
+        return stop
+
+    def __call_callbacks(self, name: str, *args, **kwargs):
+        with self.__phase_timer.phase(name):
+            for callback in self.get_callbacks(name):
+                callback_name = name + "/" + get_callback_name(callback)
+                with self.__phase_timer.phase(callback_name):
+                    callback(*args, **kwargs)
+
+    def __report_phase_time(self, epoch: int):
+        statistics = self.__phase_timer.get_statistics()
+        self.set_data("phase_time_statistics", statistics)
+        get_logger().info(
+            "epoch: %s, samples per second: %s, mean phase time per batch (ms): %s",
+            epoch,
+            statistics["samples_per_second"],
+            {
+                name: round(1000 * phase["mean"], 3)
+                for name, phase in statistics["phases"].items()
+            },
+        )
+        for callback in self.get_callbacks("phase_time_callbacks"):
+            callback(self, epoch, statistics)
+
+    def __save_checkpoint(
+        self,
+        checkpoint_writer: CheckpointWriter,
+        epoch: int,
+        batch_index: int,
+        epoch_random_states: Optional[dict],
+        epoch_training_loss: float,
+    ):
+        random_states = get_random_states()
+        if epoch_random_states is None:
+            epoch_random_states = random_states
+        # copy on the training thread so that later steps can not modify the checkpoint
+        checkpoint_writer.save(
+            copy_to_cpu(
+                {
+                    "epoch": epoch,
+                    "batch_index": batch_index,
+                    "model_state_dict": self.model.state_dict(),
+                    "optimizer_state_dict": self.get_optimizer().state_dict(),
+                    "lr_scheduler_state_dict": self.get_lr_scheduler().state_dict(),
+                    "epoch_random_states": epoch_random_states,
+                    "random_states": random_states,
+                    "epoch_training_loss": epoch_training_loss,
+                    "training_loss": self.training_loss,
+                    "validation_loss": self.validation_loss,
+                    "validation_accuracy": self.validation_accuracy,
+                    "test_loss": self.test_loss,
+                    "test_accuracy": self.test_accuracy,
+                }
+            )
+        )
 
     # TODO:drop it and merge to dataset code
     def decode_batch(self, batch):
@@ -275,25 +670,3 @@ class BasicTrainer:
         self.validation_accuracy = {}
         self.test_loss = {}
         self.test_accuracy = {}
-
-    @staticmethod
-    def __repeated_training(number: int, trainer, training_callback: Callable):
-        results: dict = dict()
-        for idx in range(number):
-            statistics = training_callback(idx, trainer)
-            assert isinstance(statistics, dict)
-            for k, v in statistics.items():
-                tensor = None
-                if isinstance(v, list):
-                    tensor = torch.Tensor(v)
-                elif isinstance(v, dict):
-                    tensor = torch.Tensor([v[k] for k in sorted(v.keys())])
-                else:
-                    raise RuntimeError("unsupported value" + str(v))
-                if k in results:
-                    results[k] += tensor
-                else:
-                    results[k] = tensor
-        for k, v in results.items():
-            results[k] = v / number
-        return results
@@ -0,0 +1,149 @@
+import os
+import random
+import threading
+
+import numpy
+import torch
+from cyy_naive_lib.log import get_logger
+
+CHECKPOINT_FILE_NAME = "checkpoint.pt"
+
+
+def copy_to_cpu(data):
+    r"""
+    Return a copy of data in which all tensors are detached CPU clones, so that training can modify the original.
+    """
+    if isinstance(data, torch.Tensor):
+        return data.detach().to("cpu", copy=True)
+    if isinstance(data, dict):
+        return {k: copy_to_cpu(v) for k, v in data.items()}
+    if isinstance(data, list):
+        return [copy_to_cpu(v) for v in data]
+    if isinstance(data, tuple):
+        return tuple(copy_to_cpu(v) for v in data)
+    return data
+
+
+def get_random_states() -> dict:
+    states = {
+        "torch": torch.get_rng_state(),
+        "random": random.getstate(),
+        "numpy": numpy.random.get_state(),
+    }
+    if torch.cuda.is_available():
+        states["cuda"] = torch.cuda.get_rng_state_all()
+    return states
+
+
+def set_random_states(states: dict):
+    torch.set_rng_state(states["torch"])
+    random.setstate(states["random"])
+    numpy.random.set_state(states["numpy"])
+    if "cuda" in states and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(states["cuda"])
+
+
+def load_checkpoint(checkpoint_dir: str, map_location=None) -> dict:
+    return torch.load(
+        os.path.join(checkpoint_dir, CHECKPOINT_FILE_NAME),
+        map_location=map_location,
+        weights_only=False,
+    )
+
+
+class CheckpointWriter:
+    r"""
+    Write checkpoints to a directory in a background thread.
+    Each checkpoint is written to a temporary file which is then renamed, so the directory always holds a complete checkpoint.
+    If a new checkpoint arrives before the previous one is written, the previous one is dropped.
+    """
+
+    def __init__(self, checkpoint_dir: str):
+        self.__checkpoint_dir = checkpoint_dir
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        self.__condition = threading.Condition()
+        self.__pending_state = None
+        self.__writing = False
+        self.__stopped = False
+        self.__exception = None
+        self.__thread = threading.Thread(target=self.__write_loop, daemon=True)
+        self.__thread.start()
+
+    @property
+    def checkpoint_dir(self):
+        return self.__checkpoint_dir
+
+    def save(self, state: dict):
+        r"""
+        Queue state for writing, the caller must not modify it afterwards.
+        """
+        with self.__condition:
+            self.__raise_exception()
+            assert not self.__stopped
+            if self.__pending_state is not None:
+                get_logger().debug("drop unwritten checkpoint")
+            self.__pending_state = state
+            self.__condition.notify_all()
+
+    def flush(self):
+        r"""
+        Block until the queued checkpoint is on disk.
+        """
+        with self.__condition:
+            self.__condition.wait_for(
+                lambda: self.__exception is not None
+                or (self.__pending_state is None and not self.__writing)
+            )
+            self.__raise_exception()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            with self.__condition:
+                self.__stopped = True
+                self.__condition.notify_all()
+            self.__thread.join()
+
+    def __raise_exception(self):
+        if self.__exception is not None:
+            exception = self.__exception
+            self.__exception = None
+            raise exception
+
+    def __write_loop(self):
+        while True:
+            with self.__condition:
+                self.__condition.wait_for(
+                    lambda: self.__stopped or self.__pending_state is not None
+                )
+                if self.__pending_state is None:
+                    return
+                state = self.__pending_state
+                self.__pending_state = None
+                self.__writing = True
+            try:
+                self.__write(state)
+            except BaseException as e:
+                get_logger().error("failed to write checkpoint: %s", e)
+                with self.__condition:
+                    self.__exception = e
+            finally:
+                with self.__condition:
+                    self.__writing = False
+                    self.__condition.notify_all()
+
+    def __write(self, state: dict):
+        path = os.path.join(self.__checkpoint_dir, CHECKPOINT_FILE_NAME)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            torch.save(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        get_logger().debug(
+            "write checkpoint of epoch %s batch %s to %s",
+            state.get("epoch"),
+            state.get("batch_index"),
+            path,
+        )
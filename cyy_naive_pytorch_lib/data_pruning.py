@@ -0,0 +1,123 @@
+import torch
+import torch.nn.functional as F
+from cyy_naive_lib.log import get_logger
+
+from dataset import get_original_indices, sub_dataset
+from repeated_training import copy_trainer_with_shared_datasets
+
+
+class SampleScoreRecorder:
+    r"""
+    An after_batch_callback that scores the training samples by the batch outputs, using the instance indices in batch[2].
+    Scores are kept in tensors preallocated on the device, so recording needs no synchronization with the host.
+    score_type is one of
+    "el2n": the L2 norm of the error between the predicted probabilities and the one-hot label (Paul et al., 2021),
+    "loss": the loss of the sample,
+    both from the last time the sample was trained, and
+    "forgetting": the number of times the prediction of the sample changed from correct to incorrect (Toneva et al., 2019),
+    where samples never predicted correctly get infinity.
+    Higher scores mean harder samples.
+    """
+
+    score_types = ("el2n", "loss", "forgetting")
+
+    def __init__(self, sample_num: int, score_type: str = "el2n", device=None):
+        if score_type not in SampleScoreRecorder.score_types:
+            raise RuntimeError("unknown score type:" + score_type)
+        self.__score_type = score_type
+        self.__scores = torch.zeros(sample_num, device=device)
+        self.__correct = torch.zeros(sample_num, dtype=torch.bool, device=device)
+        self.__learned = torch.zeros(sample_num, dtype=torch.bool, device=device)
+
+    @property
+    def scores(self) -> torch.Tensor:
+        if self.__score_type == "forgetting":
+            return torch.where(
+                self.__learned,
+                self.__scores,
+                torch.full_like(self.__scores, float("inf")),
+            ).cpu()
+        return self.__scores.cpu()
+
+    def __call__(self, trainer, batch_index, batch, **kwargs):
+        output = kwargs.get("batch_output")
+        if output is None:
+            raise RuntimeError("sample scores need the outputs of the model")
+        output = output.float()
+        device = self.__scores.device
+        indices = batch[2].to(device, non_blocking=True)
+        targets = batch[1].to(output.device, non_blocking=True).view(-1)
+        if self.__score_type == "el2n":
+            errors = F.softmax(output, dim=1) - F.one_hot(targets, output.shape[1])
+            self.__scores[indices] = torch.linalg.vector_norm(errors, dim=1).to(device)
+            return
+        if self.__score_type == "loss":
+            # log_softmax also normalizes outputs which are log probabilities already
+            self.__scores[indices] = F.nll_loss(
+                F.log_softmax(output, dim=1), targets, reduction="none"
+            ).to(device)
+            return
+        correct = torch.eq(output.argmax(dim=1), targets).to(device)
+        self.__scores[indices] += (self.__correct[indices] & ~correct).float()
+        self.__correct[indices] = correct
+        self.__learned[indices] |= correct
+
+
+def score_training_samples(
+    trainer, warm_up_epoch: int, score_type: str = "el2n", **kwargs
+) -> torch.Tensor:
+    r"""
+    Train a copy of the trainer for warm_up_epoch epochs and return the scores of its training samples recorded by SampleScoreRecorder.
+    The lr scheduler is created for the epochs of the hyper parameter so that warm-up follows the early part of the full training.
+    kwargs are passed to train.
+    """
+    trainer = copy_trainer_with_shared_datasets(trainer)
+    trainer.set_test_dataset(None)
+    trainer.remove_optimizer()
+    recorder = SampleScoreRecorder(
+        len(trainer.training_dataset), score_type, trainer.device
+    )
+    trainer.add_callback("after_batch_callbacks", recorder)
+    trainer.set_stop_criterion(lambda _, epoch, __: epoch >= warm_up_epoch)
+    trainer.train(**kwargs)
+    return recorder.scores
+
+
+def rank_samples(scores: torch.Tensor) -> list:
+    r"""
+    Return the sample indices from the easiest to the hardest.
+    """
+    return torch.argsort(scores, stable=True).tolist()
+
+
+def prune_training_dataset(
+    trainer,
+    pruning_fraction: float,
+    warm_up_epoch: int,
+    score_type: str = "el2n",
+    **kwargs
+) -> list:
+    r"""
+    Replace the training dataset of the trainer with a subset without the easiest pruning_fraction of the samples,
+    ranked by score_training_samples.
+    Return the sorted indices of the kept samples in the dataset from which the training dataset is derived, see get_original_indices,
+    which can be loaded by --training_dataset_indices_path.
+    The instance indices of later batches are positions in the new training dataset.
+    """
+    assert 0 <= pruning_fraction < 1
+    scores = score_training_samples(trainer, warm_up_epoch, score_type, **kwargs)
+    ranked_indices = rank_samples(scores)
+    kept_indices = sorted(ranked_indices[round(pruning_fraction * len(scores)) :])
+    get_logger().info(
+        "keep %s of %s training samples by %s scores",
+        len(kept_indices),
+        len(scores),
+        score_type,
+    )
+    original_indices = sorted(
+        get_original_indices(trainer.training_dataset, kept_indices)
+    )
+    trainer.set_training_dataset(sub_dataset(trainer.training_dataset, kept_indices))
+    # the optimizer depends on the size of the training dataset
+    trainer.remove_optimizer()
+    return original_indices
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+import math
+import time
+from typing import Callable, Optional
+
+
+class BatchEchoer:
+    r"""
+    Iterate over a BatchPrefetcher and yield each batch echo_num times as (batch_index, echo_index, batch, decoded_batch),
+    so that training steps on echoed batches hide the time spent waiting for data (Choi et al., 2019).
+    batch_index counts the batches of the prefetcher from start_batch_index, and the echoes of a batch share it together with batch[2], the instance indices.
+    If echo_fun is given, the inputs of the decoded batch of an echo are replaced by echo_fun(inputs), for example to re-augment them.
+    If echo_num is not given, it adapts after each batch by the data wait time of the batch relative to the mean compute time of its echoes:
+    it increases by their ratio if the wait time is at least half of the compute time,
+    and decreases by one if the wait time is less than a tenth of it, within 1 and max_echo_num.
+    """
+
+    def __init__(
+        self,
+        batch_prefetcher,
+        decode_fun: Callable,
+        echo_num: Optional[int] = None,
+        max_echo_num: int = 4,
+        echo_fun: Optional[Callable] = None,
+        start_batch_index: int = 0,
+    ):
+        assert echo_num is None or echo_num >= 1
+        assert max_echo_num >= 1
+        self.__batch_prefetcher = batch_prefetcher
+        self.__decode_fun = decode_fun
+        self.__fixed_echo_num = echo_num
+        self.__max_echo_num = max_echo_num
+        self.__echo_fun = echo_fun
+        self.__start_batch_index = start_batch_index
+        self.echo_num = echo_num if echo_num is not None else 1
+        self.step_num = 0
+
+    def __iter__(self):
+        iterator = iter(self.__batch_prefetcher)
+        batch_index = self.__start_batch_index
+        while True:
+            start_time = time.perf_counter()
+            try:
+                batch, decoded_batch = next(iterator)
+            except StopIteration:
+                return
+            if decoded_batch is None:
+                decoded_batch = self.__decode_fun(batch)
+            wait_time = time.perf_counter() - start_time
+            echo_num = self.echo_num
+            compute_time = 0.0
+            for echo_index in range(echo_num):
+                echoed_batch = decoded_batch
+                if echo_index > 0 and self.__echo_fun is not None:
+                    echoed_batch = (
+                        self.__echo_fun(decoded_batch[0]),
+                        *decoded_batch[1:],
+                    )
+                start_time = time.perf_counter()
+                self.step_num += 1
+                yield (batch_index, echo_index, batch, echoed_batch)
+                compute_time += time.perf_counter() - start_time
+            self.__adapt_echo_num(wait_time, compute_time / echo_num)
+            batch_index += 1
+
+    def __adapt_echo_num(self, wait_time: float, compute_time: float):
+        if self.__fixed_echo_num is not None or compute_time <= 0:
+            return
+        ratio = wait_time / compute_time
+        if ratio >= 0.5:
+            self.echo_num += math.ceil(ratio)
+        elif ratio < 0.1:
+            self.echo_num -= 1
+        self.echo_num = min(max(self.echo_num, 1), self.__max_echo_num)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+import itertools
+import queue
+import threading
+import time
+from typing import Callable, Optional
+
+from checkpoint import set_random_states
+
+
+class BatchPrefetcher:
+    r"""
+    Iterate over a dataloader and yield each batch with its decoded form.
+    If depth is positive, a background thread fetches and decodes up to depth batches ahead,
+    otherwise batches are fetched synchronously and the decoded form is None.
+    Batches are also fetched synchronously if the dataloader loads them in this process,
+    because its transforms would draw from the global random state concurrently with training.
+    The first skipped_batch_num batches are fetched in this thread to replay the loading but dropped without decoding,
+    and then random_states are restored if given, so that the remaining batches load as in an uninterrupted run.
+    The time spent waiting for batches is accumulated in wait_time.
+    """
+
+    def __init__(
+        self,
+        dataloader,
+        depth: int,
+        decode_fun: Callable,
+        skipped_batch_num: int = 0,
+        random_states: Optional[dict] = None,
+    ):
+        self.__dataloader = dataloader
+        self.__depth = depth
+        self.__decode_fun = decode_fun
+        self.__skipped_batch_num = skipped_batch_num
+        self.__random_states = random_states
+        self.__stop_event = threading.Event()
+        self.wait_time = 0.0
+        self.batch_num = 0
+
+    def __iter__(self):
+        # create the iterator in this thread so that sampling consumes the random state in the same order as before
+        iterator = iter(self.__dataloader)
+        for _ in itertools.islice(iterator, self.__skipped_batch_num):
+            pass
+        if self.__random_states is not None:
+            set_random_states(self.__random_states)
+        if self.__depth <= 0 or getattr(self.__dataloader, "num_workers", 0) == 0:
+            yield from self.__iterate_synchronously(iterator)
+            return
+
+        batch_queue: queue.Queue = queue.Queue(maxsize=self.__depth)
+        self.__stop_event.clear()
+        thread = threading.Thread(
+            target=self.__fetch, args=(iterator, batch_queue), daemon=True
+        )
+        thread.start()
+        try:
+            while True:
+                start_time = time.perf_counter()
+                item = batch_queue.get()
+                self.wait_time += time.perf_counter() - start_time
+                if item is None:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                self.batch_num += 1
+                yield item
+        finally:
+            self.__stop_event.set()
+            thread.join()
+
+    def __iterate_synchronously(self, iterator):
+        while True:
+            start_time = time.perf_counter()
+            try:
+                batch = next(iterator)
+            except StopIteration:
+                return
+            self.wait_time += time.perf_counter() - start_time
+            self.batch_num += 1
+            yield (batch, None)
+
+    def __fetch(self, iterator, batch_queue: queue.Queue):
+        try:
+            for batch in iterator:
+                if not self.__put(batch_queue, (batch, self.__decode_fun(batch))):
+                    return
+            self.__put(batch_queue, None)
+        except BaseException as e:
+            self.__put(batch_queue, e)
+
+    def __put(self, batch_queue: queue.Queue, item) -> bool:
+        while not self.__stop_event.is_set():
+            try:
+                batch_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
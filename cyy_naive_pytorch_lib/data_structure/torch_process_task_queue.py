@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+import functools
+import multiprocessing
+import uuid
+from typing import Callable, Optional
+
+import torch.multiprocessing
+from cyy_naive_lib.data_structure.task_queue import TaskQueue
+
+from device import get_devices
+
+
+class _ReleaseWorkerSessionsTask:
+    pass
+
+
+def _run_task(worker_fun: Callable, thread_num: Optional[int], barrier, task, args):
+    if isinstance(task, _ReleaseWorkerSessionsTask):
+        release_worker_session_states()
+        # each worker waits for the others so that it takes exactly one release task
+        barrier.wait()
+        return True
+    if thread_num is not None and torch.get_num_threads() != thread_num:
+        torch.set_num_threads(thread_num)
+    return worker_fun(task, args)
+
+
+class TorchProcessTaskQueue(TaskQueue):
+    r"""
+    A process task queue whose workers run on CUDA devices if there are any, otherwise on CPU.
+    CPU workers divide the intra-op threads among themselves.
+    release_worker_sessions() drops the session states kept by the workers.
+    """
+
+    def __init__(self, worker_fun: Callable, worker_num: Optional[int] = None):
+        self.devices = get_devices()
+        if worker_num is None:
+            worker_num = len(self.devices)
+        thread_num = None
+        if self.devices[0].type == "cpu":
+            thread_num = max(1, multiprocessing.cpu_count() // worker_num)
+        ctx = torch.multiprocessing.get_context("spawn")
+        self.__worker_num = worker_num
+        super().__init__(
+            worker_fun=functools.partial(
+                _run_task, worker_fun, thread_num, ctx.Barrier(worker_num)
+            ),
+            ctx=ctx,
+            worker_num=worker_num,
+        )
+
+    def _get_extra_task_arguments(self, worker_id):
+        return [self.devices[worker_id % len(self.devices)]]
+
+    def release_worker_sessions(self):
+        r"""
+        Ask every worker to drop its session state, there must be no pending tasks.
+        """
+        for _ in range(self.__worker_num):
+            self.add_task(_ReleaseWorkerSessionsTask())
+        for _ in range(self.__worker_num):
+            self.get_result()
+
+
+class WorkerSession:
+    r"""
+    Data shared by all tasks of a session, such as a model and a batch.
+    Tensors are moved to shared memory once, so tasks only carry their handles.
+    """
+
+    def __init__(self, **kwargs):
+        self.session_id = uuid.uuid4().hex
+        for value in kwargs.values():
+            if isinstance(value, torch.Tensor):
+                value.share_memory_()
+            elif isinstance(value, torch.nn.Module):
+                value.share_memory()
+            elif isinstance(value, list):
+                for element in value:
+                    if isinstance(element, torch.Tensor):
+                        element.share_memory_()
+        self.data = kwargs
+
+
+__worker_session_states: dict = dict()
+
+
+def get_worker_session_state(session: WorkerSession, init_fun: Callable):
+    r"""
+    Called in workers to get the state built from a session, only the state of the latest session is kept.
+    """
+    if session.session_id not in __worker_session_states:
+        __worker_session_states.clear()
+        __worker_session_states[session.session_id] = init_fun(session.data)
+    return __worker_session_states[session.session_id]
+
+
+def release_worker_session_states():
+    __worker_session_states.clear()
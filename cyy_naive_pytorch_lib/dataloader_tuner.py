@@ -0,0 +1,149 @@
+import copy
+import itertools
+import multiprocessing
+
+from cyy_naive_lib.log import get_logger
+from cyy_naive_lib.time_counter import TimeCounter
+
+from device import put_data_to_device
+from hyper_parameter import HyperParameter, save_dataloader_config
+from ml_types import MachineLearningPhase
+from model_loss import ModelWithLoss
+from tensor import get_batch_size
+
+
+def measure_dataloader_throughput(
+    hyper_parameter: HyperParameter, dataset, device, batch_num: int
+) -> float:
+    r"""
+    Return the samples per second of loading batches and moving them to the device.
+    The first batch is excluded so that worker startup is not counted.
+    """
+    sample_num = 0
+    counter = None
+    for batch_index, batch in enumerate(
+        hyper_parameter.get_dataloader(dataset, MachineLearningPhase.Training)
+    ):
+        put_data_to_device(batch[0], device)
+        put_data_to_device(batch[1], device)
+        if counter is None:
+            counter = TimeCounter()
+            continue
+        sample_num += get_batch_size(batch[0])
+        if batch_index >= batch_num:
+            break
+    if counter is None or sample_num == 0:
+        return 0.0
+    return sample_num * 1000 / counter.elapsed_milliseconds()
+
+
+def measure_training_throughput(
+    model_with_loss: ModelWithLoss,
+    hyper_parameter: HyperParameter,
+    dataset,
+    device,
+    batch_num: int,
+) -> float:
+    r"""
+    Return the samples per second of full training steps on a copy of the model.
+    """
+    model_with_loss = copy.deepcopy(model_with_loss)
+    model_with_loss.set_model_mode(MachineLearningPhase.Training)
+    model_with_loss.model.to(device)
+    optimizer = hyper_parameter.get_optimizer(
+        model_with_loss.model.parameters(), len(dataset)
+    )
+    sample_num = 0
+    counter = None
+    for batch_index, batch in enumerate(
+        hyper_parameter.get_dataloader(dataset, MachineLearningPhase.Training)
+    ):
+        inputs = put_data_to_device(batch[0], device)
+        targets = put_data_to_device(batch[1], device)
+        optimizer.zero_grad()
+        loss = model_with_loss(
+            inputs,
+            targets,
+            phase=MachineLearningPhase.Training,
+            autocast_dtype=hyper_parameter.autocast_dtype,
+        )["loss"]
+        loss.backward()
+        optimizer.step()
+        if counter is None:
+            counter = TimeCounter()
+            continue
+        sample_num += get_batch_size(inputs)
+        if batch_index >= batch_num:
+            break
+    if counter is None or sample_num == 0:
+        return 0.0
+    return sample_num * 1000 / counter.elapsed_milliseconds()
+
+
+def tune_dataloader(
+    trainer,
+    dataset_name: str = None,
+    worker_nums=None,
+    prefetch_factors=None,
+    pin_memories=None,
+    batch_num: int = 20,
+    candidate_num: int = 3,
+) -> dict:
+    r"""
+    Search dataloader settings for the training dataset of the trainer.
+    All settings are ranked by the throughput of the data pipeline alone, then the best candidate_num settings
+    are ranked by the throughput of full training steps.
+    The best setting is applied to the trainer and, if dataset_name is given, saved for get_recommended_hyper_parameter.
+    """
+    cpu_count = multiprocessing.cpu_count()
+    if worker_nums is None:
+        worker_nums = sorted({0, 1, 2, 4, max(1, cpu_count // 2), cpu_count})
+    if prefetch_factors is None:
+        prefetch_factors = [2, 4, 8]
+    if pin_memories is None:
+        pin_memories = [False]
+        if trainer.device.type == "cuda":
+            pin_memories.append(True)
+
+    hyper_parameter = copy.deepcopy(trainer.hyper_parameter)
+    results = []
+    for worker_num, prefetch_factor, pin_memory in itertools.product(
+        worker_nums, prefetch_factors, pin_memories
+    ):
+        if worker_num == 0 and prefetch_factor != prefetch_factors[0]:
+            # prefetch_factor has no effect without workers
+            continue
+        config = {
+            "worker_num": worker_num,
+            "prefetch_factor": prefetch_factor if worker_num > 0 else None,
+            "pin_memory": pin_memory,
+        }
+        hyper_parameter.set_dataloader_config(config)
+        config["data_samples_per_second"] = measure_dataloader_throughput(
+            hyper_parameter, trainer.training_dataset, trainer.device, batch_num
+        )
+        HyperParameter.release_dataloaders()
+        get_logger().info("dataloader config %s", config)
+        results.append(config)
+
+    results.sort(key=lambda config: config["data_samples_per_second"], reverse=True)
+    candidates = results[:candidate_num]
+    for config in candidates:
+        hyper_parameter.set_dataloader_config(config)
+        config["training_samples_per_second"] = measure_training_throughput(
+            trainer.model_with_loss,
+            hyper_parameter,
+            trainer.training_dataset,
+            trainer.device,
+            batch_num,
+        )
+        HyperParameter.release_dataloaders()
+        get_logger().info("dataloader config %s", config)
+    best_config = max(
+        candidates, key=lambda config: config["training_samples_per_second"]
+    )
+    get_logger().info("best dataloader config is %s", best_config)
+    trainer.hyper_parameter.set_dataloader_config(best_config)
+    if dataset_name is not None:
+        save_dataloader_config(dataset_name, best_config)
+    return best_config
@@ -56,6 +56,19 @@ def sub_dataset(dataset: torch.utils.data.Dataset, indices: Iterable):
     return torch.utils.data.Subset(dataset, indices)
 
 
+def get_original_indices(dataset: torch.utils.data.Dataset, indices: Iterable) -> list:
+    r"""
+    Map indices of a dataset to those of the dataset it is derived from by subsets, filters and mappers.
+    """
+    indices = list(indices)
+    while True:
+        if isinstance(dataset, (torch.utils.data.Subset, DatasetFilter)):
+            indices = [dataset.indices[index] for index in indices]
+        elif not isinstance(dataset, DatasetMapper):
+            return indices
+        dataset = dataset.dataset
+
+
 def sample_dataset(dataset: torch.utils.data.Dataset, index: int):
     return sub_dataset(dataset, [index])
 
@@ -232,6 +245,10 @@ def set_dataset_dir(new_dataset_dir):
     __dataset_dir = new_dataset_dir
 
 
+def get_dataset_dir() -> str:
+    return __dataset_dir
+
+
 __datasets: dict = dict()
 
 
@@ -1,5 +1,7 @@
 #!/usr/bin/env python3
 
+import multiprocessing
+
 import torch
 
 
@@ -16,6 +18,30 @@ def get_cuda_devices():
     return devices
 
 
+__cpu_worker_num = None
+
+
+def set_cpu_worker_num(worker_num: int):
+    global __cpu_worker_num
+    assert worker_num > 0
+    __cpu_worker_num = worker_num
+
+
+def get_cpu_worker_num() -> int:
+    if __cpu_worker_num is not None:
+        return __cpu_worker_num
+    return min(8, multiprocessing.cpu_count())
+
+
+def get_devices():
+    r"""
+    Return the devices for worker processes, that is, all CUDA devices or a CPU device per CPU worker.
+    """
+    if torch.cuda.is_available():
+        return get_cuda_devices()
+    return [get_cpu_device()] * get_cpu_worker_num()
+
+
 def get_device():
     if torch.cuda.is_available():
         return torch.device("cuda")
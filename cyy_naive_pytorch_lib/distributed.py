@@ -0,0 +1,187 @@
+import logging
+import multiprocessing
+import pickle
+import socket
+import time
+
+import torch
+import torch.distributed as dist
+from cyy_naive_lib.log import get_logger
+
+
+def is_distributed() -> bool:
+    return dist.is_available() and dist.is_initialized()
+
+
+def get_rank() -> int:
+    if is_distributed():
+        return dist.get_rank()
+    return 0
+
+
+def get_world_size() -> int:
+    if is_distributed():
+        return dist.get_world_size()
+    return 1
+
+
+def is_main_process() -> bool:
+    return get_rank() == 0
+
+
+def all_reduce_sum(tensor: torch.Tensor) -> torch.Tensor:
+    r"""
+    Return the sum of the tensor over all processes.
+    """
+    if not is_distributed():
+        return tensor
+    tensor = tensor.clone()
+    dist.all_reduce(tensor)
+    return tensor
+
+
+def broadcast_tensor(tensor: torch.Tensor, src: int = 0):
+    dist.broadcast(tensor, src)
+
+
+def broadcast_model(model: torch.nn.Module, src: int = 0):
+    r"""
+    Copy the parameters and buffers of the model in process src to all processes.
+    """
+    with torch.no_grad():
+        for tensor in model.state_dict().values():
+            dist.broadcast(tensor, src)
+
+
+class GradientAllReducer:
+    r"""
+    Average the gradients of a model over all processes.
+    The all-reduce of a parameter starts as soon as its gradient is accumulated, so communication overlaps with the rest of backward.
+    With gradient accumulation, it should only be enabled for the last backward of a step.
+    """
+
+    def __init__(self, model: torch.nn.Module):
+        self.__world_size = get_world_size()
+        self.__enabled = True
+        self.__handles: list = []
+        self.__hooks = [
+            parameter.register_post_accumulate_grad_hook(self.__all_reduce)
+            for parameter in model.parameters()
+            if parameter.requires_grad
+        ]
+
+    def set_enabled(self, enabled: bool):
+        self.__enabled = enabled
+
+    def wait(self):
+        r"""
+        Block until the gradients are averaged.
+        """
+        for handle in self.__handles:
+            handle.wait()
+        self.__handles = []
+
+    def remove(self):
+        self.wait()
+        for hook in self.__hooks:
+            hook.remove()
+        self.__hooks = []
+
+    def __all_reduce(self, parameter):
+        if not self.__enabled:
+            return
+        # gloo has no average operation
+        parameter.grad.div_(self.__world_size)
+        self.__handles.append(dist.all_reduce(parameter.grad, async_op=True))
+
+
+def __get_free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def __run_process(rank, world_size, backend, init_method, fun, args, result_queue):
+    dist.init_process_group(
+        backend, init_method=init_method, rank=rank, world_size=world_size
+    )
+    if rank != 0:
+        get_logger().setLevel(logging.WARNING)
+    try:
+        result = fun(*args)
+        if rank == 0:
+            # pickle by value instead of sharing tensors with a process that is about to exit
+            result_queue.put(pickle.dumps(result))
+    finally:
+        dist.destroy_process_group()
+
+
+def run_data_parallel(fun, world_size: int, args=(), backend="gloo"):
+    r"""
+    Run fun(*args) in world_size local processes that form a process group, and return the result of rank 0.
+    Processes are forked so that fun and args need not be picklable, thus CUDA must not be initialized in this process.
+    """
+    assert world_size >= 1
+    ctx = multiprocessing.get_context("fork")
+    result_queue = ctx.SimpleQueue()
+    init_method = "tcp://127.0.0.1:" + str(__get_free_port())
+    processes = []
+    for rank in range(world_size):
+        process = ctx.Process(
+            target=__run_process,
+            args=(rank, world_size, backend, init_method, fun, args, result_queue),
+        )
+        process.start()
+        processes.append(process)
+    # the result is read before joining since a large result blocks rank 0 until it is read
+    result = None
+    while result is None:
+        if not result_queue.empty():
+            result = pickle.loads(result_queue.get())
+            break
+        failed_ranks = [
+            rank for rank, process in enumerate(processes) if process.exitcode
+        ]
+        if failed_ranks:
+            # the other processes may wait for the failed ones forever
+            for process in processes:
+                process.terminate()
+            raise RuntimeError("data parallel processes failed:" + str(failed_ranks))
+        if all(process.exitcode is not None for process in processes):
+            if result_queue.empty():
+                raise RuntimeError("rank 0 returns no result")
+            continue
+        time.sleep(0.1)
+    for process in processes:
+        process.join()
+    return result
+
+
+def __train_in_process(trainer, kwargs):
+    trainer.train(**kwargs)
+    return {
+        "model_state_dict": {
+            k: v.detach().cpu() for k, v in trainer.model.state_dict().items()
+        },
+        "training_loss": trainer.training_loss,
+        "validation_loss": trainer.validation_loss,
+        "validation_accuracy": trainer.validation_accuracy,
+        "test_loss": trainer.test_loss,
+        "test_accuracy": trainer.test_accuracy,
+    }
+
+
+def train_data_parallel(trainer, world_size: int, backend="gloo", **kwargs):
+    r"""
+    Train the trainer with data parallelism in world_size local processes, then load the weights and losses of rank 0 into it.
+    """
+    result = run_data_parallel(
+        __train_in_process, world_size, args=(trainer, kwargs), backend=backend
+    )
+    trainer.model.load_state_dict(result["model_state_dict"])
+    trainer.training_loss = result["training_loss"]
+    trainer.validation_loss = result["validation_loss"]
+    trainer.validation_accuracy = result["validation_accuracy"]
+    trainer.test_loss = result["test_loss"]
+    trainer.test_accuracy = result["test_accuracy"]
+    return trainer
@@ -11,7 +11,7 @@ def get_dataset_gradients(
     tensor_dict = create_tensor_dict(cache_size)
     tensor_dict.set_storage_dir(tempfile.gettempdir())
     for k, dataset in dataset_dict.items():
-        tmp_inferencer = copy.deepcopy(inferencer)
+        tmp_inferencer = copy.copy(inferencer)
         tmp_inferencer.set_dataset(dataset)
         tensor_dict[str(k)] = tmp_inferencer.get_gradient()
     return tensor_dict
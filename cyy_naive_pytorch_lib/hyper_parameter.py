@@ -1,16 +1,94 @@
+import atexit
+import collections
 import inspect
+import json
+import math
 import multiprocessing
+import os
 from typing import Callable, Optional
 
 import torch
 import torch.optim as optim
 from cyy_naive_lib.log import get_logger
 
-from dataset import dataset_with_indices
+from dataset import dataset_with_indices, get_dataset_dir
+from distributed import get_rank, get_world_size
+from large_batch_optimizer import LAMB, LARS
 from ml_types import MachineLearningPhase
 
 
+class WarmupCosineAnnealingLR(optim.lr_scheduler.LambdaLR):
+    r"""
+    Increase the learning rate linearly over warmup_steps and then anneal it by a cosine until total_steps, stepped after each batch.
+    """
+
+    def __init__(self, optimizer, warmup_steps: int, total_steps: int):
+        def lr_lambda(step):
+            if step < warmup_steps:
+                return (step + 1) / warmup_steps
+            progress = (step - warmup_steps) / max(1, total_steps - warmup_steps)
+            return 0.5 * (1 + math.cos(math.pi * min(progress, 1)))
+
+        super().__init__(optimizer, lr_lambda)
+
+
+class LinearWarmupLR:
+    r"""
+    Wrap an lr scheduler stepped after each epoch, so that the learning rates increase linearly in the first warmup_epoch epochs,
+    epoch e using e / (warmup_epoch + 1) of them, before lr_scheduler takes over.
+    step() takes the metrics of ReduceLROnPlateau.
+    """
+
+    def __init__(self, optimizer, lr_scheduler, warmup_epoch: int):
+        assert warmup_epoch >= 1
+        self.optimizer = optimizer
+        self.lr_scheduler = lr_scheduler
+        self.warmup_epoch = warmup_epoch
+        self.base_lrs = [group["lr"] for group in optimizer.param_groups]
+        self.last_epoch = 0
+        self.__set_warmup_lrs()
+
+    def step(self, metrics=None):
+        self.last_epoch += 1
+        if self.last_epoch < self.warmup_epoch:
+            self.__set_warmup_lrs()
+        elif self.last_epoch == self.warmup_epoch:
+            for group, base_lr in zip(self.optimizer.param_groups, self.base_lrs):
+                group["lr"] = base_lr
+        elif isinstance(self.lr_scheduler, optim.lr_scheduler.ReduceLROnPlateau):
+            self.lr_scheduler.step(metrics)
+        else:
+            self.lr_scheduler.step()
+
+    def __set_warmup_lrs(self):
+        factor = (self.last_epoch + 1) / (self.warmup_epoch + 1)
+        for group, base_lr in zip(self.optimizer.param_groups, self.base_lrs):
+            group["lr"] = base_lr * factor
+
+    def state_dict(self) -> dict:
+        return {
+            "base_lrs": self.base_lrs,
+            "last_epoch": self.last_epoch,
+            "lr_scheduler": self.lr_scheduler.state_dict(),
+        }
+
+    def load_state_dict(self, state_dict: dict):
+        self.base_lrs = state_dict["base_lrs"]
+        self.last_epoch = state_dict["last_epoch"]
+        self.lr_scheduler.load_state_dict(state_dict["lr_scheduler"])
+
+    def __repr__(self):
+        return "LinearWarmupLR(warmup_epoch={}, lr_scheduler={})".format(
+            self.warmup_epoch, self.lr_scheduler
+        )
+
+
 class HyperParameter:
+    __dataloaders: collections.OrderedDict = collections.OrderedDict()
+    __dataloader_pid = os.getpid()
+    __inherited_dataloaders: list = []
+    __max_dataloader_num = 4
+
     def __init__(
         self,
         epoch: int,
@@ -24,9 +102,15 @@ class HyperParameter:
         self.__learning_rate = learning_rate
         self.__weight_decay = weight_decay
         self.__momentum = momentum
+        self.__warmup_epoch = 0
+        self.__max_learning_rate: Optional[float] = None
         self.__collate_fn = None
         self.__lr_scheduler_factory: Optional[Callable] = None
         self.__optimizer_factory: Optional[Callable] = None
+        self.__autocast_dtype: Optional[torch.dtype] = None
+        self.__dataloader_worker_num: Optional[int] = None
+        self.__dataloader_prefetch_factor: Optional[int] = None
+        self.__dataloader_pin_memory: bool = False
 
     @property
     def epoch(self):
@@ -49,6 +133,18 @@ class HyperParameter:
     def set_learning_rate(self, learning_rate):
         self.__learning_rate = learning_rate
 
+    @property
+    def max_learning_rate(self) -> float:
+        r"""
+        The peak learning rate of OneCycleLR, 5 times the learning rate if not set.
+        """
+        if self.__max_learning_rate is None:
+            return self.learning_rate * 5
+        return self.__max_learning_rate
+
+    def set_max_learning_rate(self, max_learning_rate: Optional[float]):
+        self.__max_learning_rate = max_learning_rate
+
     @property
     def weight_decay(self):
         return self.__weight_decay
@@ -63,18 +159,88 @@ class HyperParameter:
     def set_momentum(self, momentum):
         self.__momentum = momentum
 
+    @property
+    def warmup_epoch(self) -> int:
+        return self.__warmup_epoch
+
+    def set_warmup_epoch(self, warmup_epoch: int):
+        r"""
+        The number of epochs over which the learning rate increases linearly, by WarmupCosineAnnealingLR,
+        or by LinearWarmupLR for other lr schedulers stepped after each epoch.
+        """
+        self.__warmup_epoch = warmup_epoch
+
+    def scale_batch_size(
+        self, batch_size: int, world_size: int = 1, use_warmup_lr_scheduler: bool = False
+    ):
+        r"""
+        Set the batch size of each process and adjust the other hyper parameters for the global batch size batch_size * world_size,
+        assuming that they are tuned for the current batch size in a single process.
+        The learning rate is scaled linearly for SGD and LARS (Goyal et al., 2017), and by the square root for adaptive optimizers.
+        To keep large learning rates stable in early epochs, the warmup takes log2 of the scale epochs, at most 5 epochs, see set_warmup_epoch.
+        If use_warmup_lr_scheduler is set, the lr scheduler is also replaced with WarmupCosineAnnealingLR.
+        """
+        scale = batch_size * world_size / self.batch_size
+        if self.__optimizer_factory in (optim.SGD, LARS):
+            learning_rate = self.learning_rate * scale
+        else:
+            learning_rate = self.learning_rate * math.sqrt(scale)
+        warmup_epoch = 0
+        if scale > 1:
+            warmup_epoch = min(math.ceil(math.log2(scale)), 5, self.epoch - 1)
+        get_logger().info(
+            "scale batch size from %s to %s, learning rate from %s to %s with %s warmup epochs",
+            self.batch_size,
+            batch_size * world_size,
+            self.learning_rate,
+            learning_rate,
+            warmup_epoch,
+        )
+        if self.__max_learning_rate is not None:
+            self.__max_learning_rate *= learning_rate / self.learning_rate
+        self.set_batch_size(batch_size)
+        self.set_learning_rate(learning_rate)
+        self.set_warmup_epoch(warmup_epoch)
+        if use_warmup_lr_scheduler:
+            get_logger().info("replace the lr scheduler with WarmupCosineAnnealingLR")
+            self.set_lr_scheduler_factory(
+                HyperParameter.get_lr_scheduler_factory("WarmupCosineAnnealingLR")
+            )
+
+    @property
+    def autocast_dtype(self) -> Optional[torch.dtype]:
+        return self.__autocast_dtype
+
+    def set_autocast_dtype(self, autocast_dtype: Optional[torch.dtype]):
+        r"""
+        Run forward passes of training and inference under autocast with this dtype, None means float32.
+        Training only supports bfloat16, since float16 gradients underflow without loss scaling.
+        """
+        self.__autocast_dtype = autocast_dtype
+
     def set_lr_scheduler_factory(self, lr_scheduler_factory: Callable):
         self.__lr_scheduler_factory = lr_scheduler_factory
 
     def get_lr_scheduler(self, optimizer, training_dataset_size: int):
         assert self.__lr_scheduler_factory is not None
-        return self.__lr_scheduler_factory(
+        lr_scheduler = self.__lr_scheduler_factory(
             self, optimizer, training_dataset_size=training_dataset_size
         )
+        if self.__warmup_epoch > 0:
+            if isinstance(lr_scheduler, torch.optim.lr_scheduler.OneCycleLR):
+                get_logger().info("OneCycleLR warms up by itself")
+            elif not HyperParameter.lr_scheduler_step_after_batch(lr_scheduler):
+                lr_scheduler = LinearWarmupLR(
+                    optimizer, lr_scheduler, self.__warmup_epoch
+                )
+        return lr_scheduler
 
     @staticmethod
     def lr_scheduler_step_after_batch(lr_scheduler):
-        return isinstance(lr_scheduler, torch.optim.lr_scheduler.OneCycleLR)
+        return isinstance(
+            lr_scheduler,
+            (torch.optim.lr_scheduler.OneCycleLR, WarmupCosineAnnealingLR),
+        )
 
     @staticmethod
     def get_lr_scheduler_factory(name, dataset_name=None):
@@ -88,7 +254,6 @@ class HyperParameter:
                 get_logger().info("ReduceLROnPlateau patience is %s", patience)
                 return optim.lr_scheduler.ReduceLROnPlateau(
                     optimizer,
-                    verbose=True,
                     factor=0.1,
                     patience=patience,
                 )
@@ -96,7 +261,7 @@ class HyperParameter:
                 return optim.lr_scheduler.OneCycleLR(
                     optimizer,
                     pct_start=0.4,
-                    max_lr=hyper_parameter.learning_rate * 5,
+                    max_lr=hyper_parameter.max_learning_rate,
                     total_steps=(
                         hyper_parameter.epoch
                         * (
@@ -108,6 +273,15 @@ class HyperParameter:
                     three_phase=True,
                     div_factor=10,
                 )
+            if name == "WarmupCosineAnnealingLR":
+                batch_num = (
+                    training_dataset_size + hyper_parameter.batch_size - 1
+                ) // hyper_parameter.batch_size
+                return WarmupCosineAnnealingLR(
+                    optimizer,
+                    warmup_steps=hyper_parameter.warmup_epoch * batch_num,
+                    total_steps=hyper_parameter.epoch * batch_num,
+                )
             raise RuntimeError("unknown learning rate scheduler:" + name)
 
         return callback
@@ -121,6 +295,10 @@ class HyperParameter:
             return optim.SGD
         if name == "Adam":
             return optim.Adam
+        if name == "LARS":
+            return LARS
+        if name == "LAMB":
+            return LAMB
         raise RuntimeError("unknown optimizer:" + name)
 
     def get_optimizer(self, params, training_dataset_size: int):
@@ -143,14 +321,145 @@ class HyperParameter:
     def set_dataloader_collate_fn(self, collate_fn):
         self.__collate_fn = collate_fn
 
-    def get_dataloader(self, dataset, phase: MachineLearningPhase):
-        return torch.utils.data.DataLoader(
-            dataset_with_indices(dataset),
+    @property
+    def dataloader_worker_num(self) -> int:
+        if self.__dataloader_worker_num is None:
+            return multiprocessing.cpu_count()
+        return self.__dataloader_worker_num
+
+    def set_dataloader_worker_num(self, worker_num: int):
+        self.__dataloader_worker_num = worker_num
+
+    @property
+    def dataloader_prefetch_factor(self) -> Optional[int]:
+        return self.__dataloader_prefetch_factor
+
+    def set_dataloader_prefetch_factor(self, prefetch_factor: int):
+        self.__dataloader_prefetch_factor = prefetch_factor
+
+    @property
+    def dataloader_pin_memory(self) -> bool:
+        return self.__dataloader_pin_memory
+
+    def set_dataloader_pin_memory(self, pin_memory: bool):
+        self.__dataloader_pin_memory = pin_memory
+
+    def get_dataloader_config(self) -> dict:
+        return {
+            "worker_num": self.__dataloader_worker_num,
+            "prefetch_factor": self.dataloader_prefetch_factor,
+            "pin_memory": self.dataloader_pin_memory,
+        }
+
+    def set_dataloader_config(self, config: dict):
+        self.__dataloader_worker_num = config.get("worker_num")
+        self.__dataloader_prefetch_factor = config.get("prefetch_factor")
+        self.__dataloader_pin_memory = config.get("pin_memory", False)
+
+    def apply_config(self, config: dict, dataset_name: str = None):
+        r"""
+        Set the hyper parameters in config, where the optimizer and the lr scheduler are given by their names.
+        """
+        if "epoch" in config:
+            self.set_epoch(config["epoch"])
+        if "batch_size" in config:
+            self.set_batch_size(config["batch_size"])
+        if "learning_rate" in config:
+            self.set_learning_rate(config["learning_rate"])
+        if "max_learning_rate" in config:
+            self.set_max_learning_rate(config["max_learning_rate"])
+        if "momentum" in config:
+            self.set_momentum(config["momentum"])
+        if "weight_decay" in config:
+            self.set_weight_decay(config["weight_decay"])
+        if "warmup_epoch" in config:
+            self.set_warmup_epoch(config["warmup_epoch"])
+        if "optimizer" in config:
+            self.set_optimizer_factory(
+                HyperParameter.get_optimizer_factory(config["optimizer"])
+            )
+        if "lr_scheduler" in config:
+            self.set_lr_scheduler_factory(
+                HyperParameter.get_lr_scheduler_factory(
+                    config["lr_scheduler"], dataset_name
+                )
+            )
+
+    def get_dataloader(self, dataset, phase: MachineLearningPhase, cache: bool = True):
+        r"""
+        Dataloaders are cached by dataset, phase and loading settings, and their workers persist across epochs until release_dataloaders is called.
+        If cache is not set, a new dataloader is returned without touching the cache.
+        Since workers persist, in-place changes of a dataset after its first use are not seen by its dataloader.
+        In data parallel training, each process loads its own part of the training dataset,
+        and the epoch of its DistributedSampler must be set to shuffle differently in each epoch.
+        Dataloaders of other phases have their own random generators, so that evaluation, which may run in a background thread,
+        does not draw from the global random state used by training.
+        """
+        worker_num = self.dataloader_worker_num
+        world_size = get_world_size()
+        key = (
+            id(dataset),
+            phase,
+            self.batch_size,
+            id(self.__collate_fn),
+            worker_num,
+            self.dataloader_prefetch_factor,
+            self.dataloader_pin_memory,
+            world_size,
+        )
+        HyperParameter.__check_dataloader_process()
+        if cache and key in HyperParameter.__dataloaders:
+            HyperParameter.__dataloaders.move_to_end(key)
+            return HyperParameter.__dataloaders[key][1]
+
+        kwargs: dict = dict()
+        if worker_num > 0:
+            kwargs["persistent_workers"] = cache
+            if self.dataloader_prefetch_factor is not None:
+                kwargs["prefetch_factor"] = self.dataloader_prefetch_factor
+        indexed_dataset = dataset_with_indices(dataset)
+        shuffle = phase == MachineLearningPhase.Training
+        if not shuffle:
+            kwargs["generator"] = torch.Generator()
+        if shuffle and world_size > 1:
+            kwargs["sampler"] = torch.utils.data.distributed.DistributedSampler(
+                indexed_dataset, num_replicas=world_size, rank=get_rank()
+            )
+            shuffle = False
+        dataloader = torch.utils.data.DataLoader(
+            indexed_dataset,
             batch_size=self.batch_size,
-            shuffle=(phase == MachineLearningPhase.Training),
+            shuffle=shuffle,
             collate_fn=self.__collate_fn,
-            num_workers=multiprocessing.cpu_count(),
+            num_workers=worker_num,
+            pin_memory=self.dataloader_pin_memory,
+            **kwargs,
         )
+        if not cache:
+            return dataloader
+        # keep the dataset so that its id is not reused
+        HyperParameter.__dataloaders[key] = (dataset, dataloader)
+        while len(HyperParameter.__dataloaders) > HyperParameter.__max_dataloader_num:
+            HyperParameter.__dataloaders.popitem(last=False)
+        return dataloader
+
+    @staticmethod
+    def release_dataloaders():
+        r"""
+        Drop the cached dataloaders and shut down their workers.
+        """
+        HyperParameter.__check_dataloader_process()
+        HyperParameter.__dataloaders.clear()
+
+    @staticmethod
+    def __check_dataloader_process():
+        if HyperParameter.__dataloader_pid == os.getpid():
+            return
+        # the workers of dataloaders inherited by a forked process belong to the parent,
+        # so they are kept alive without use since releasing them would shut down the workers of the parent
+        HyperParameter.__inherited_dataloaders.append(HyperParameter.__dataloaders)
+        HyperParameter.__dataloaders = collections.OrderedDict()
+        HyperParameter.__dataloader_pid = os.getpid()
 
     def __str__(self):
         s = (
@@ -165,12 +474,71 @@ class HyperParameter:
         )
         if self.__optimizer_factory is not None:
             s += " optimizer:" + str(self.__optimizer_factory)
+        if self.__autocast_dtype is not None:
+            s += " autocast_dtype:" + str(self.__autocast_dtype)
         # if self.lr_scheduler_factory is not None:
         #     s += str(self.lr_scheduler_factory)
 
         return s
 
 
+atexit.register(HyperParameter.release_dataloaders)
+
+
+def __get_dataloader_config_path() -> str:
+    return os.path.join(get_dataset_dir(), "dataloader_config.json")
+
+
+def load_dataloader_config(dataset_name: str) -> Optional[dict]:
+    r"""
+    Return the dataloader settings saved for the dataset by the tuner, if any.
+    """
+    path = __get_dataloader_config_path()
+    if not os.path.isfile(path):
+        return None
+    with open(path, "rt") as f:
+        return json.load(f).get(dataset_name)
+
+
+def save_dataloader_config(dataset_name: str, config: dict):
+    path = __get_dataloader_config_path()
+    configs = dict()
+    if os.path.isfile(path):
+        with open(path, "rt") as f:
+            configs = json.load(f)
+    configs[dataset_name] = config
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wt") as f:
+        json.dump(configs, f)
+
+
+def __get_hyper_parameter_config_path() -> str:
+    return os.path.join(get_dataset_dir(), "hyper_parameter_config.json")
+
+
+def load_hyper_parameter_config(dataset_name: str, model_name: str) -> Optional[dict]:
+    r"""
+    Return the hyper parameters saved for the dataset and the model by a sweep, if any.
+    """
+    path = __get_hyper_parameter_config_path()
+    if not os.path.isfile(path):
+        return None
+    with open(path, "rt") as f:
+        return json.load(f).get(dataset_name, {}).get(model_name)
+
+
+def save_hyper_parameter_config(dataset_name: str, model_name: str, config: dict):
+    path = __get_hyper_parameter_config_path()
+    configs: dict = dict()
+    if os.path.isfile(path):
+        with open(path, "rt") as f:
+            configs = json.load(f)
+    configs.setdefault(dataset_name, {})[model_name] = config
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wt") as f:
+        json.dump(configs, f)
+
+
 def get_recommended_hyper_parameter(
     dataset_name: str, model_name: str
 ) -> Optional[HyperParameter]:
@@ -216,4 +584,21 @@ def get_recommended_hyper_parameter(
             )
         )
     hyper_parameter.set_optimizer_factory(HyperParameter.get_optimizer_factory("Adam"))
+    config = load_hyper_parameter_config(dataset_name, model_name)
+    if config is not None:
+        get_logger().info(
+            "use swept hyper parameter config %s for dataset %s and model %s",
+            config,
+            dataset_name,
+            model_name,
+        )
+        hyper_parameter.apply_config(config, dataset_name)
+    dataloader_config = load_dataloader_config(dataset_name)
+    if dataloader_config is not None:
+        get_logger().info(
+            "use tuned dataloader config %s for dataset %s",
+            dataloader_config,
+            dataset_name,
+        )
+        hyper_parameter.set_dataloader_config(dataloader_config)
     return hyper_parameter
@@ -0,0 +1,254 @@
+import copy
+import itertools
+import math
+import os
+from typing import Optional
+
+import numpy
+import torch
+from cyy_naive_lib.log import get_logger
+
+from device import put_data_to_device
+from hyper_parameter import (
+    HyperParameter,
+    load_hyper_parameter_config,
+    save_hyper_parameter_config,
+)
+from ml_types import MachineLearningPhase
+from model_loss import ModelWithLoss
+
+
+def __get_training_copy(model_with_loss: ModelWithLoss, device) -> ModelWithLoss:
+    model_with_loss = copy.deepcopy(model_with_loss)
+    model_with_loss.set_model_mode(MachineLearningPhase.Training)
+    model_with_loss.model.to(device)
+    return model_with_loss
+
+
+def measure_training_memory(
+    model_with_loss: ModelWithLoss,
+    hyper_parameter: HyperParameter,
+    batch,
+    training_dataset_size: int,
+    device,
+) -> int:
+    r"""
+    Return the bytes used by a training step of the batch on a copy of the model.
+    On CUDA it is the peak memory allocated by the process, otherwise it is the total size of the parameters,
+    gradients, optimizer states, inputs and the tensors saved for backward.
+    """
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+        torch.cuda.reset_peak_memory_stats(device)
+    model_with_loss = __get_training_copy(model_with_loss, device)
+    optimizer = hyper_parameter.get_optimizer(
+        model_with_loss.model.parameters(), training_dataset_size
+    )
+    inputs = put_data_to_device(batch[0], device)
+    targets = put_data_to_device(batch[1], device)
+    storage_sizes: dict = dict()
+
+    def add_tensor(tensor):
+        storage = tensor.untyped_storage()
+        storage_sizes[storage.data_ptr()] = storage.nbytes()
+
+    def pack_hook(tensor):
+        add_tensor(tensor)
+        return tensor
+
+    with torch.autograd.graph.saved_tensors_hooks(pack_hook, lambda tensor: tensor):
+        loss = model_with_loss(
+            inputs,
+            targets,
+            phase=MachineLearningPhase.Training,
+            autocast_dtype=hyper_parameter.autocast_dtype,
+        )["loss"]
+    loss.backward()
+    optimizer.step()
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+        return torch.cuda.max_memory_allocated(device)
+    tensors = []
+    for parameter in model_with_loss.model.parameters():
+        tensors.append(parameter)
+        if parameter.grad is not None:
+            tensors.append(parameter.grad)
+    for state in optimizer.state.values():
+        tensors += [v for v in state.values() if isinstance(v, torch.Tensor)]
+    if isinstance(inputs, torch.Tensor):
+        tensors.append(inputs)
+    for tensor in tensors:
+        add_tensor(tensor)
+    return sum(storage_sizes.values())
+
+
+def find_batch_size(
+    trainer, memory_budget: Optional[int] = None, max_batch_size: Optional[int] = None
+) -> int:
+    r"""
+    Return the largest power of two batch size whose training step fits in memory_budget bytes.
+    The default budget is 90% of the memory of a CUDA device, or half of the available memory of the host.
+    """
+    device = trainer.device
+    if memory_budget is None:
+        if device.type == "cuda":
+            memory_budget = int(
+                torch.cuda.get_device_properties(device).total_memory * 0.9
+            )
+        else:
+            memory_budget = (
+                os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_AVPHYS_PAGES") // 2
+            )
+    if max_batch_size is None:
+        max_batch_size = len(trainer.training_dataset)
+
+    hyper_parameter = copy.deepcopy(trainer.hyper_parameter)
+    hyper_parameter.set_dataloader_worker_num(0)
+    batch_size = None
+    candidate = 1
+    while candidate <= max_batch_size:
+        hyper_parameter.set_batch_size(candidate)
+        batch = next(
+            iter(
+                hyper_parameter.get_dataloader(
+                    trainer.training_dataset, MachineLearningPhase.Training, cache=False
+                )
+            )
+        )
+        try:
+            memory = measure_training_memory(
+                trainer.model_with_loss,
+                hyper_parameter,
+                batch,
+                len(trainer.training_dataset),
+                device,
+            )
+        except RuntimeError as e:
+            if "out of memory" not in str(e):
+                raise
+            memory = None
+            if device.type == "cuda":
+                torch.cuda.empty_cache()
+        get_logger().info("batch size %s uses %s bytes", candidate, memory)
+        if memory is None or memory > memory_budget:
+            break
+        batch_size = candidate
+        candidate *= 2
+    if batch_size is None:
+        raise RuntimeError("no batch size fits in the memory budget")
+    return batch_size
+
+
+def lr_range_test(
+    trainer,
+    min_lr: float = 1e-7,
+    max_lr: float = 10,
+    batch_num: int = 100,
+    smoothing: float = 0.98,
+    divergence_factor: float = 4,
+) -> dict:
+    r"""
+    Train a copy of the model with the learning rate increasing exponentially from min_lr to max_lr over batch_num batches (Smith, 2017),
+    and stop early when the smoothed loss exceeds divergence_factor times its minimum.
+    Return the learning rates and smoothed losses, the learning rate at the steepest descent of the loss before its minimum,
+    ignoring the first tenth of the batches, as learning_rate,
+    and a tenth of the learning rate at the minimum loss as max_learning_rate for OneCycleLR.
+    """
+    assert batch_num >= 2
+    model_with_loss = __get_training_copy(trainer.model_with_loss, trainer.device)
+    hyper_parameter = trainer.hyper_parameter
+    optimizer = hyper_parameter.get_optimizer(
+        model_with_loss.model.parameters(), len(trainer.training_dataset)
+    )
+    gamma = (max_lr / min_lr) ** (1 / (batch_num - 1))
+    dataloader = hyper_parameter.get_dataloader(
+        trainer.training_dataset, MachineLearningPhase.Training
+    )
+    learning_rates: list = []
+    losses: list = []
+    average_loss = 0.0
+    for batch_index, batch in zip(
+        range(batch_num), itertools.chain.from_iterable(itertools.repeat(dataloader))
+    ):
+        learning_rate = min_lr * gamma ** batch_index
+        for group in optimizer.param_groups:
+            group["lr"] = learning_rate
+        optimizer.zero_grad()
+        loss = model_with_loss(
+            put_data_to_device(batch[0], trainer.device),
+            put_data_to_device(batch[1], trainer.device),
+            phase=MachineLearningPhase.Training,
+            autocast_dtype=hyper_parameter.autocast_dtype,
+        )["loss"]
+        loss.backward()
+        optimizer.step()
+        # the loss is checked in each batch to stop at divergence
+        loss = loss.item()
+        if not math.isfinite(loss):
+            break
+        average_loss = smoothing * average_loss + (1 - smoothing) * loss
+        smoothed_loss = average_loss / (1 - smoothing ** (batch_index + 1))
+        learning_rates.append(learning_rate)
+        losses.append(smoothed_loss)
+        if smoothed_loss > divergence_factor * min(losses):
+            break
+    assert losses
+
+    min_index = int(numpy.argmin(losses))
+    # the smoothed losses of the first batches are noisy
+    start_index = min(len(losses) // 10, min_index)
+    steepest_index = min_index
+    if min_index - start_index >= 2:
+        steepest_index = start_index + int(
+            numpy.argmin(
+                numpy.gradient(
+                    losses[start_index : min_index + 1],
+                    numpy.log(learning_rates[start_index : min_index + 1]),
+                )
+            )
+        )
+    result = {
+        "learning_rates": learning_rates,
+        "losses": losses,
+        "learning_rate": learning_rates[steepest_index],
+        "max_learning_rate": learning_rates[min_index] / 10,
+    }
+    get_logger().info(
+        "lr range test suggests learning rate %s and max learning rate %s",
+        result["learning_rate"],
+        result["max_learning_rate"],
+    )
+    return result
+
+
+def find_hyper_parameter(
+    trainer,
+    memory_budget: Optional[int] = None,
+    dataset_name: Optional[str] = None,
+    model_name: Optional[str] = None,
+    **kwargs
+) -> dict:
+    r"""
+    Set the batch size found by find_batch_size, then the learning rates suggested by lr_range_test with that batch size,
+    to the hyper parameter of the trainer.
+    kwargs are passed to lr_range_test.
+    The result is also saved for get_recommended_hyper_parameter if dataset_name and model_name are given.
+    """
+    hyper_parameter = trainer.hyper_parameter
+    hyper_parameter.set_batch_size(find_batch_size(trainer, memory_budget))
+    result = lr_range_test(trainer, **kwargs)
+    hyper_parameter.set_learning_rate(result["learning_rate"])
+    hyper_parameter.set_max_learning_rate(result["max_learning_rate"])
+    # the optimizer and the lr scheduler are created again with the new values
+    trainer.remove_optimizer()
+    config = {
+        "batch_size": hyper_parameter.batch_size,
+        "learning_rate": hyper_parameter.learning_rate,
+        "max_learning_rate": hyper_parameter.max_learning_rate,
+    }
+    get_logger().info("found hyper parameter config %s", config)
+    if dataset_name is not None and model_name is not None:
+        saved_config = load_hyper_parameter_config(dataset_name, model_name) or dict()
+        saved_config.update(config)
+        save_hyper_parameter_config(dataset_name, model_name, saved_config)
+    return config
@@ -0,0 +1,197 @@
+import copy
+import logging
+import multiprocessing
+import os
+import pickle
+import queue
+import random
+import shutil
+import tempfile
+from typing import Optional
+
+import torch
+from cyy_naive_lib.log import get_logger
+
+from hyper_parameter import save_hyper_parameter_config
+from repeated_training import copy_trainer_with_shared_datasets
+
+
+def __train_trial(
+    trainer,
+    config: dict,
+    max_epoch: int,
+    epoch: int,
+    checkpoint_dir: str,
+    dataset_name: Optional[str],
+):
+    trainer = copy_trainer_with_shared_datasets(trainer)
+    # trials are compared by validation accuracy only
+    trainer.set_test_dataset(None)
+    hyper_parameter = copy.deepcopy(trainer.hyper_parameter)
+    hyper_parameter.apply_config(config, dataset_name)
+    # the lr scheduler is created for the full budget, and the trial stops at the epoch of its rung
+    hyper_parameter.set_epoch(max_epoch)
+    trainer.set_hyper_parameter(hyper_parameter)
+    trainer.remove_optimizer()
+    if os.path.isfile(os.path.join(checkpoint_dir, "checkpoint.pt")):
+        trainer.resume_from(checkpoint_dir)
+    trainer.set_stop_criterion(lambda trainer, cur_epoch, _: cur_epoch >= epoch)
+    trainer.train(checkpoint_dir=checkpoint_dir)
+    return trainer.validation_accuracy[epoch]
+
+
+def __run_trial(trial_id, rung, thread_num, args, result_queue):
+    try:
+        get_logger().setLevel(logging.ERROR)
+        torch.set_num_threads(thread_num)
+        result = (trial_id, rung, __train_trial(*args))
+    except BaseException as e:
+        result = (trial_id, rung, e)
+    result_queue.put(pickle.dumps(result))
+
+
+def sample_configs(search_space: dict, trial_num: int, seed: int = 0) -> list:
+    r"""
+    Sample trial_num configs, each value of which is drawn from the candidates of search_space.
+    """
+    rng = random.Random(seed)
+    return [
+        {k: rng.choice(candidates) for k, candidates in sorted(search_space.items())}
+        for _ in range(trial_num)
+    ]
+
+
+def sweep_hyper_parameter(
+    trainer,
+    search_space: dict,
+    trial_num: int,
+    max_epoch: int,
+    min_epoch: int = 1,
+    reduction_factor: int = 3,
+    worker_num: Optional[int] = None,
+    dataset_name: Optional[str] = None,
+    model_name: Optional[str] = None,
+    save_dir: Optional[str] = None,
+    seed: int = 0,
+) -> dict:
+    r"""
+    Search hyper parameters by asynchronous successive halving (ASHA).
+    search_space maps the keys of HyperParameter.apply_config to candidate values.
+    A trial first trains min_epoch epochs, and it is promoted to train reduction_factor times longer,
+    up to max_epoch, if its validation accuracy is in the top 1/reduction_factor of the finished trials at its rung.
+    Promoted trials resume from their checkpoints in save_dir, which is a temporary directory removed after the sweep if not given.
+    The best config is returned, and saved for get_recommended_hyper_parameter if dataset_name and model_name are given.
+    Trials are forked processes, thus CUDA must not be initialized in this process.
+    """
+    assert 1 <= min_epoch <= max_epoch
+    assert reduction_factor >= 2
+    rung_epochs = [min_epoch]
+    while rung_epochs[-1] * reduction_factor <= max_epoch:
+        rung_epochs.append(rung_epochs[-1] * reduction_factor)
+    if rung_epochs[-1] < max_epoch:
+        rung_epochs.append(max_epoch)
+
+    configs = sample_configs(search_space, trial_num, seed)
+    temp_dir = None
+    if save_dir is None:
+        temp_dir = tempfile.mkdtemp()
+        save_dir = temp_dir
+    cpu_count = multiprocessing.cpu_count()
+    if worker_num is None:
+        worker_num = min(trial_num, cpu_count)
+    thread_num = max(1, cpu_count // worker_num)
+    rung_results: list = [dict() for _ in rung_epochs]
+    promoted_trials: list = [set() for _ in rung_epochs]
+    next_trial_id = 0
+
+    def get_job():
+        nonlocal next_trial_id
+        for rung in reversed(range(len(rung_epochs) - 1)):
+            results = rung_results[rung]
+            top_trials = sorted(results, key=lambda trial_id: -results[trial_id])[
+                : len(results) // reduction_factor
+            ]
+            for trial_id in top_trials:
+                if trial_id not in promoted_trials[rung]:
+                    promoted_trials[rung].add(trial_id)
+                    return (trial_id, rung + 1)
+        if next_trial_id < trial_num:
+            next_trial_id += 1
+            return (next_trial_id - 1, 0)
+        return None
+
+    ctx = multiprocessing.get_context("fork")
+    result_queue = ctx.Queue()
+    processes: dict = dict()
+    try:
+        while True:
+            while len(processes) < worker_num:
+                job = get_job()
+                if job is None:
+                    break
+                trial_id, rung = job
+                get_logger().info(
+                    "train trial %s with config %s to epoch %s",
+                    trial_id,
+                    configs[trial_id],
+                    rung_epochs[rung],
+                )
+                process = ctx.Process(
+                    target=__run_trial,
+                    args=(
+                        trial_id,
+                        rung,
+                        thread_num,
+                        (
+                            trainer,
+                            configs[trial_id],
+                            max_epoch,
+                            rung_epochs[rung],
+                            os.path.join(save_dir, str(trial_id)),
+                            dataset_name,
+                        ),
+                        result_queue,
+                    ),
+                )
+                process.start()
+                processes[trial_id] = process
+            if not processes:
+                break
+            try:
+                trial_id, rung, result = pickle.loads(result_queue.get(timeout=1))
+            except queue.Empty:
+                for trial_id, process in processes.items():
+                    if process.exitcode:
+                        raise RuntimeError(
+                            "trial %s exits with %s" % (trial_id, process.exitcode)
+                        )
+                continue
+            processes.pop(trial_id).join()
+            if isinstance(result, BaseException):
+                raise result
+            get_logger().info(
+                "trial %s gets validation accuracy %s at epoch %s",
+                trial_id,
+                result,
+                rung_epochs[rung],
+            )
+            rung_results[rung][trial_id] = result
+    finally:
+        for process in processes.values():
+            process.terminate()
+            process.join()
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    best_rung = max(rung for rung, results in enumerate(rung_results) if results)
+    results = rung_results[best_rung]
+    best_trial_id = max(results, key=lambda trial_id: results[trial_id])
+    best = {
+        "config": configs[best_trial_id],
+        "validation_accuracy": results[best_trial_id],
+        "epoch": rung_epochs[best_rung],
+    }
+    get_logger().info("best hyper parameter config is %s", best)
+    if dataset_name is not None and model_name is not None:
+        save_hyper_parameter_config(dataset_name, model_name, best["config"])
+    return best
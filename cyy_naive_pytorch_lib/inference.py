@@ -74,7 +74,9 @@ class Inferencer:
         )
 
         use_grad = kwargs.get("use_grad", False)
-        with torch.set_grad_enabled(use_grad):
+        with torch.set_grad_enabled(
+            use_grad
+        ), self.__model_with_loss.fused_for_inference():
             get_logger().debug("use device %s", self.device)
             self.__model_with_loss.set_model_mode(self.__phase)
             self.model.zero_grad()
@@ -86,20 +88,24 @@ class Inferencer:
                 targets = put_data_to_device(batch[1], self.device)
                 real_batch_size = get_batch_size(inputs)
 
-                result = self.__model_with_loss(inputs, targets, phase=self.__phase)
+                result = self.__model_with_loss(
+                    inputs,
+                    targets,
+                    phase=self.__phase,
+                    autocast_dtype=self.__hyper_parameter.autocast_dtype,
+                )
                 batch_loss = result["loss"]
 
                 for callback in kwargs.get("after_batch_callbacks", []):
                     callback(batch, result, targets)
 
-                normalized_batch_loss = batch_loss
                 if self.__model_with_loss.is_averaged_loss():
-                    normalized_batch_loss *= real_batch_size
-                normalized_batch_loss /= len(self.__dataset)
+                    batch_loss = batch_loss * real_batch_size
                 if use_grad:
-                    normalized_batch_loss.backward()
-                total_loss += normalized_batch_loss
-            return total_loss
+                    (batch_loss / len(self.__dataset)).backward()
+                # sum on the device and normalize once at the end
+                total_loss += batch_loss.detach()
+            return total_loss / len(self.__dataset)
 
     def get_gradient(self):
         self.inference(use_grad=True)
@@ -114,33 +120,40 @@ class ClassificationInferencer(Inferencer):
         instance_prob = dict()
         per_sample_prob = kwargs.get("per_sample_prob", False)
 
-        dataset_util = DatasetUtil(self.dataset)
-        for label in dataset_util.get_labels():
-            classification_correct_count_per_label[label] = 0
-            classification_count_per_label[label] = 0
+        labels = DatasetUtil(self.dataset).get_labels()
+        label_num = max(labels) + 1
+        # count on the device to avoid synchronizing for every batch
+        count_per_label = torch.zeros(label_num, dtype=torch.long, device=self.device)
+        correct_count_per_label = torch.zeros(
+            label_num, dtype=torch.long, device=self.device
+        )
 
         def after_batch_callback(batch, result, targets):
             nonlocal per_sample_prob
             nonlocal instance_output
             output = result["output"]
-            for target in targets:
-                label = DatasetUtil.get_label_from_target(target)
-                classification_count_per_label[label] += 1
+            targets = targets.view(-1)
+            count_per_label.add_(torch.bincount(targets, minlength=label_num))
             if per_sample_prob:
                 for i, instance_index in enumerate(batch[2]):
                     instance_index = instance_index.data.item()
                     instance_output[instance_index] = output[i]
             correct = torch.eq(torch.max(output, dim=1)[1], targets).view(-1)
-
-            for label in classification_correct_count_per_label:
-                classification_correct_count_per_label[label] += torch.sum(
-                    correct[targets == label]
-                ).item()
+            correct_count_per_label.add_(
+                torch.bincount(targets[correct], minlength=label_num)
+            )
 
         kwargs = Inferencer.prepend_callback(
             kwargs, "after_batch_callbacks", after_batch_callback
         )
         loss = super().inference(**kwargs)
+        count_per_label = count_per_label.tolist()
+        correct_count_per_label = correct_count_per_label.tolist()
+        for label in labels:
+            classification_count_per_label[label] = count_per_label[label]
+            classification_correct_count_per_label[label] = correct_count_per_label[
+                label
+            ]
 
         if per_sample_prob:
             last_layer = list(self.model.modules())[-1]
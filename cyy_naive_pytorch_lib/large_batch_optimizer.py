@@ -0,0 +1,156 @@
+import torch
+
+
+def _get_trust_ratios(
+    params: list, updates: list, trust_coefficient: float, eps: float
+) -> list:
+    # computed on the device without synchronizing with the host
+    param_norms = torch.stack(torch._foreach_norm(params))
+    update_norms = torch.stack(torch._foreach_norm(updates))
+    trust_ratios = torch.where(
+        (param_norms > 0) & (update_norms > 0),
+        trust_coefficient * param_norms / (update_norms + eps),
+        torch.ones_like(param_norms),
+    )
+    return list(trust_ratios.unbind())
+
+
+class LARS(torch.optim.Optimizer):
+    r"""
+    SGD with momentum and layer-wise adaptive rate scaling (You et al., 2017).
+    The update of each weight tensor, including its weight decay, is scaled by trust_coefficient * ||w|| / ||update||,
+    while biases and normalization parameters, which have at most one dimension, are updated without scaling.
+    All parameters of a group are updated by foreach kernels.
+    """
+
+    def __init__(
+        self,
+        params,
+        lr: float,
+        momentum: float = 0.9,
+        weight_decay: float = 0,
+        trust_coefficient: float = 0.001,
+        eps: float = 1e-8,
+    ):
+        defaults = dict(
+            lr=lr,
+            momentum=momentum,
+            weight_decay=weight_decay,
+            trust_coefficient=trust_coefficient,
+            eps=eps,
+        )
+        super().__init__(params, defaults)
+
+    @torch.no_grad()
+    def step(self, closure=None):
+        loss = None
+        if closure is not None:
+            with torch.enable_grad():
+                loss = closure()
+        for group in self.param_groups:
+            params = [p for p in group["params"] if p.grad is not None]
+            if not params:
+                continue
+            updates = [p.grad for p in params]
+            if group["weight_decay"] != 0:
+                updates = torch._foreach_add(
+                    updates, params, alpha=group["weight_decay"]
+                )
+            else:
+                updates = torch._foreach_mul(updates, 1.0)
+            adapted_indices = [i for i, p in enumerate(params) if p.dim() > 1]
+            if adapted_indices:
+                adapted_updates = [updates[i] for i in adapted_indices]
+                torch._foreach_mul_(
+                    adapted_updates,
+                    _get_trust_ratios(
+                        [params[i] for i in adapted_indices],
+                        adapted_updates,
+                        group["trust_coefficient"],
+                        group["eps"],
+                    ),
+                )
+            if group["momentum"] != 0:
+                momentum_buffers = []
+                for p, update in zip(params, updates):
+                    state = self.state[p]
+                    if "momentum_buffer" not in state:
+                        state["momentum_buffer"] = torch.zeros_like(p)
+                    momentum_buffers.append(state["momentum_buffer"])
+                torch._foreach_mul_(momentum_buffers, group["momentum"])
+                torch._foreach_add_(momentum_buffers, updates)
+                updates = momentum_buffers
+            torch._foreach_add_(params, updates, alpha=-group["lr"])
+        return loss
+
+
+class LAMB(torch.optim.Optimizer):
+    r"""
+    Adam with decoupled weight decay and layer-wise adaptive rate scaling (You et al., 2020).
+    The update of each weight tensor is scaled by ||w|| / ||update||,
+    while biases and normalization parameters, which have at most one dimension, are updated as in AdamW.
+    All parameters of a group are updated by foreach kernels.
+    """
+
+    def __init__(
+        self,
+        params,
+        lr: float,
+        betas: tuple = (0.9, 0.999),
+        eps: float = 1e-6,
+        weight_decay: float = 0,
+    ):
+        defaults = dict(lr=lr, betas=betas, eps=eps, weight_decay=weight_decay)
+        super().__init__(params, defaults)
+
+    @torch.no_grad()
+    def step(self, closure=None):
+        loss = None
+        if closure is not None:
+            with torch.enable_grad():
+                loss = closure()
+        for group in self.param_groups:
+            params = [p for p in group["params"] if p.grad is not None]
+            if not params:
+                continue
+            beta1, beta2 = group["betas"]
+            grads = [p.grad for p in params]
+            exp_avgs = []
+            exp_avg_sqs = []
+            bias_corrections1 = []
+            bias_corrections2 = []
+            for p in params:
+                state = self.state[p]
+                if not state:
+                    state["step"] = 0
+                    state["exp_avg"] = torch.zeros_like(p)
+                    state["exp_avg_sq"] = torch.zeros_like(p)
+                state["step"] += 1
+                exp_avgs.append(state["exp_avg"])
+                exp_avg_sqs.append(state["exp_avg_sq"])
+                bias_corrections1.append(1 - beta1 ** state["step"])
+                bias_corrections2.append((1 - beta2 ** state["step"]) ** 0.5)
+
+            torch._foreach_lerp_(exp_avgs, grads, 1 - beta1)
+            torch._foreach_mul_(exp_avg_sqs, beta2)
+            torch._foreach_addcmul_(exp_avg_sqs, grads, grads, value=1 - beta2)
+
+            denominators = torch._foreach_sqrt(exp_avg_sqs)
+            torch._foreach_div_(denominators, bias_corrections2)
+            torch._foreach_add_(denominators, group["eps"])
+            updates = torch._foreach_div(exp_avgs, bias_corrections1)
+            torch._foreach_div_(updates, denominators)
+            if group["weight_decay"] != 0:
+                torch._foreach_add_(updates, params, alpha=group["weight_decay"])
+
+            adapted_indices = [i for i, p in enumerate(params) if p.dim() > 1]
+            if adapted_indices:
+                adapted_updates = [updates[i] for i in adapted_indices]
+                torch._foreach_mul_(
+                    adapted_updates,
+                    _get_trust_ratios(
+                        [params[i] for i in adapted_indices], adapted_updates, 1, 0
+                    ),
+                )
+            torch._foreach_add_(params, updates, alpha=-group["lr"])
+        return loss
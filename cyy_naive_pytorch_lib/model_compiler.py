@@ -0,0 +1,137 @@
+import copy
+import warnings
+from typing import Callable, Optional
+
+import torch
+from cyy_naive_lib.log import get_logger
+from torch.func import functional_call
+
+
+def get_model_structure(model: torch.nn.Module) -> tuple:
+    return (
+        model.__class__.__qualname__,
+        tuple(
+            (name, tuple(tensor.shape), tensor.dtype)
+            for name, tensor in get_model_tensors(model).items()
+        ),
+    )
+
+
+def get_model_tensors(model: torch.nn.Module) -> dict:
+    return {**dict(model.named_parameters()), **dict(model.named_buffers())}
+
+
+class ModelCompiler:
+    r"""
+    Compile the forward pass of a model together with its loss function.
+    A compiled function runs a prototype of the model with the parameters and buffers of the given model as inputs,
+    so models of the same class and structure share it. Compiled functions are cached by model structure, mode, loss function,
+    autocast dtype, grad mode and input shape.
+    torch.compile is tried first, then TorchScript tracing. If both fail, None is cached and the caller should run eagerly.
+    """
+
+    __prototypes: dict = dict()
+    __compiled_functions: dict = dict()
+
+    @staticmethod
+    def get_compiled_function(
+        model: torch.nn.Module, loss_fun: Callable, inputs, targets, autocast_dtype
+    ) -> Optional[Callable]:
+        structure = get_model_structure(model)
+        key = (
+            structure,
+            model.training,
+            torch.is_grad_enabled(),
+            repr(loss_fun),
+            autocast_dtype,
+            ModelCompiler.__get_input_signature(inputs),
+        )
+        if key in ModelCompiler.__compiled_functions:
+            return ModelCompiler.__compiled_functions[key]
+
+        prototype_key = (structure, model.training)
+        prototype = ModelCompiler.__prototypes.get(prototype_key)
+        if prototype is None:
+            prototype = copy.deepcopy(model)
+            ModelCompiler.__prototypes[prototype_key] = prototype
+
+        def forward(tensors, inputs, targets):
+            output = functional_call(prototype, tensors, (inputs,))
+            if autocast_dtype is not None:
+                output = output.float()
+            return (loss_fun(output, targets), output)
+
+        compiled_function = ModelCompiler.__compile(
+            forward, get_model_tensors(model), inputs, targets
+        )
+        ModelCompiler.__compiled_functions[key] = compiled_function
+        return compiled_function
+
+    @staticmethod
+    def clear():
+        ModelCompiler.__prototypes.clear()
+        ModelCompiler.__compiled_functions.clear()
+
+    @staticmethod
+    def __get_input_signature(inputs) -> tuple:
+        if isinstance(inputs, torch.Tensor):
+            return (tuple(inputs.shape), inputs.dtype, inputs.device.type)
+        return tuple(ModelCompiler.__get_input_signature(tensor) for tensor in inputs)
+
+    @staticmethod
+    def __copy_tensor(tensor: torch.Tensor) -> torch.Tensor:
+        # keep the type and requires_grad, which are guarded by torch.compile
+        copied_tensor = tensor.detach().clone()
+        if isinstance(tensor, torch.nn.Parameter):
+            return torch.nn.Parameter(copied_tensor, requires_grad=tensor.requires_grad)
+        return copied_tensor
+
+    @staticmethod
+    def __compile(forward, tensors: dict, inputs, targets) -> Optional[Callable]:
+        # compile with copies so that buffers such as running statistics are not updated
+        tensors = {
+            name: ModelCompiler.__copy_tensor(tensor) for name, tensor in tensors.items()
+        }
+        try:
+            compiled_forward = torch.compile(forward, dynamic=False)
+            # compile forward and backward now so that failures are found here
+            loss = compiled_forward(tensors, inputs, targets)[0]
+            if loss.requires_grad:
+                loss.backward()
+            return compiled_forward
+        except Exception as e:
+            get_logger().warning("torch.compile fails, try TorchScript: %s", e)
+        names = list(tensors.keys())
+        try:
+            traced_forward = torch.jit.trace(
+                lambda inputs, targets, *tensor_list: forward(
+                    dict(zip(names, tensor_list)), inputs, targets
+                ),
+                (inputs, targets, *tensors.values()),
+                check_trace=False,
+            )
+            return lambda tensors, inputs, targets: traced_forward(
+                inputs, targets, *[tensors[name] for name in names]
+            )
+        except Exception as e:
+            get_logger().warning("TorchScript fails, use eager mode: %s", e)
+        return None
+
+
+def fuse_for_inference(model: torch.nn.Module, inputs) -> Optional[Callable]:
+    r"""
+    Trace a copy of the model in evaluation mode, freeze it and optimize it for inference,
+    which folds batch normalizations into convolutions and fuses convolutions with activations through oneDNN on CPU.
+    The result is bound to the current weights and returns None if tracing fails.
+    """
+    model = copy.deepcopy(model).eval()
+    try:
+        with torch.no_grad(), warnings.catch_warnings():
+            # TorchScript is deprecated, but it still has the oneDNN fusion passes
+            warnings.simplefilter("ignore", FutureWarning)
+            return torch.jit.optimize_for_inference(
+                torch.jit.freeze(torch.jit.trace(model, inputs, check_trace=False))
+            )
+    except Exception as e:
+        get_logger().warning("fail to fuse model for inference, use eager mode: %s", e)
+    return None
@@ -1,3 +1,4 @@
+import functools
 from inspect import signature
 
 import torch
@@ -11,15 +12,21 @@ from ml_types import ModelType
 from model_loss import ModelWithLoss
 from models.densenet import DenseNet40
 from models.lenet import LeNet5
+from models.senet.se_resnet import CifarSEBasicBlock, CifarSEResNet
 
 
-def get_model(name: str, dataset: torch.utils.data.Dataset) -> ModelWithLoss:
+def get_model(
+    name: str, dataset: torch.utils.data.Dataset, channels_last: bool = False
+) -> ModelWithLoss:
     name_to_model_mapping: dict = {
         "LeNet5": LeNet5,
         "MobileNetV2": MobileNetV2,
         "QuantizableMobileNetV2": QuantizableMobileNetV2,
         "DenseNet40": DenseNet40,
         "FasterRCNN": fasterrcnn_resnet50_fpn,
+        "SEResNet20": functools.partial(CifarSEResNet, CifarSEBasicBlock, 3),
+        "SEResNet32": functools.partial(CifarSEResNet, CifarSEBasicBlock, 5),
+        "SEResNet56": functools.partial(CifarSEResNet, CifarSEBasicBlock, 9),
     }
     name_to_model_mapping = change_mapping_keys(
         name_to_model_mapping, lambda x: x.lower()
@@ -46,4 +53,7 @@ def get_model(name: str, dataset: torch.utils.data.Dataset) -> ModelWithLoss:
     if model_constructor is fasterrcnn_resnet50_fpn:
         model_type = ModelType.Detection
 
-    return ModelWithLoss(model_constructor(**kwargs), model_type=model_type)
+    model_with_loss = ModelWithLoss(model_constructor(**kwargs), model_type=model_type)
+    if channels_last:
+        model_with_loss.set_channels_last(True)
+    return model_with_loss
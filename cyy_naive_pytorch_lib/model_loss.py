@@ -1,3 +1,4 @@
+import contextlib
 from typing import Optional
 
 import torch
@@ -5,6 +6,7 @@ import torch.nn as nn
 from torchvision.models.detection.generalized_rcnn import GeneralizedRCNN
 
 from ml_types import MachineLearningPhase, ModelType
+from model_compiler import ModelCompiler, fuse_for_inference, get_model_tensors
 
 
 class ModelWithLoss:
@@ -23,6 +25,10 @@ class ModelWithLoss:
         if self.__loss_fun is None:
             self.__loss_fun = self.__choose_loss_function()
         self.__model_type = model_type
+        self.__compiled = False
+        self.__channels_last = False
+        self.__fusing = False
+        self.__fused_model = None
 
     @property
     def model(self) -> torch.nn.Module:
@@ -38,6 +44,70 @@ class ModelWithLoss:
 
     def set_model(self, model: torch.nn.Module):
         self.__model = model
+        self.__fused_model = None
+        if self.__channels_last:
+            self.__model.to(memory_format=torch.channels_last)
+
+    @property
+    def compiled(self) -> bool:
+        return self.__compiled
+
+    def set_compiled(self, compiled: bool):
+        r"""
+        In compiled mode, the model and the loss function run as a function compiled by ModelCompiler,
+        except for detection models and models that fail to compile, which run eagerly.
+        """
+        self.__compiled = compiled
+
+    @property
+    def channels_last(self) -> bool:
+        return self.__channels_last
+
+    def set_channels_last(self, channels_last: bool):
+        r"""
+        In channels_last mode, the model and 4D inputs use the channels_last memory format,
+        which oneDNN convolutions on CPU and tensor cores on GPU run without layout reorders,
+        and models are fused within fused_for_inference.
+        """
+        self.__channels_last = channels_last
+        if isinstance(self.__model, GeneralizedRCNN):
+            return
+        if channels_last:
+            self.__model.to(memory_format=torch.channels_last)
+        else:
+            self.__model.to(memory_format=torch.contiguous_format)
+
+    @contextlib.contextmanager
+    def fused_for_inference(self):
+        r"""
+        In channels_last mode, forward passes in this context without grad use a copy of the model fused by fuse_for_inference,
+        which is created on the first call, so the weights must not change in the context.
+        """
+        self.__fusing = self.__channels_last and not isinstance(
+            self.__model, GeneralizedRCNN
+        )
+        try:
+            yield
+        finally:
+            self.__fusing = False
+            self.__fused_model = None
+
+    def warm_up(self, inputs, target, phase: MachineLearningPhase, autocast_dtype=None):
+        r"""
+        Compile for inputs of this shape in phase ahead of time, without changing the model.
+        """
+        if not self.__compiled or isinstance(self.__model, GeneralizedRCNN):
+            return
+        training = self.__model.training
+        self.set_model_mode(phase)
+        try:
+            with torch.set_grad_enabled(phase == MachineLearningPhase.Training):
+                with ModelWithLoss.__get_autocast_context(inputs, autocast_dtype):
+                    ModelCompiler.get_compiled_function(
+                        self.__model, self.__loss_fun, inputs, target, autocast_dtype
+                    )
+        finally:
+            self.__model.train(training)
 
     def set_model_mode(self, phase: MachineLearningPhase):
         if isinstance(self.__model, GeneralizedRCNN):
@@ -52,26 +122,72 @@ class ModelWithLoss:
             return
         self.model.eval()
 
-    def __call__(self, inputs, target, phase: MachineLearningPhase = None) -> dict:
+    def __call__(
+        self, inputs, target, phase: MachineLearningPhase = None, autocast_dtype=None
+    ) -> dict:
+        r"""
+        If autocast_dtype is set, the forward pass runs under autocast with that dtype while the loss is computed in float32.
+        """
         if isinstance(self.__model, GeneralizedRCNN):
             detection = None
             assert phase is not None
-            if phase in (MachineLearningPhase.Training,):
-                loss_dict = self.__model(inputs, target)
-            else:
-                loss_dict, detection = self.__model(inputs, target)
+            with ModelWithLoss.__get_autocast_context(inputs, autocast_dtype):
+                if phase in (MachineLearningPhase.Training,):
+                    loss_dict = self.__model(inputs, target)
+                else:
+                    loss_dict, detection = self.__model(inputs, target)
 
-            result = {"loss": sum(loss for loss in loss_dict.values())}
+            result = {"loss": sum(loss.float() for loss in loss_dict.values())}
             if detection is not None:
                 result["detection"] = detection
             return result
 
         assert self.__loss_fun is not None
 
-        output = self.__model(inputs)
+        if (
+            self.__channels_last
+            and isinstance(inputs, torch.Tensor)
+            and inputs.dim() == 4
+        ):
+            inputs = inputs.contiguous(memory_format=torch.channels_last)
+        with ModelWithLoss.__get_autocast_context(inputs, autocast_dtype):
+            model = self.__model
+            if (
+                self.__fusing
+                and not self.__model.training
+                and not torch.is_grad_enabled()
+            ):
+                if self.__fused_model is None:
+                    self.__fused_model = fuse_for_inference(self.__model, inputs)
+                    # do not try again in this context
+                    self.__fusing = self.__fused_model is not None
+                if self.__fused_model is not None:
+                    model = self.__fused_model
+            elif self.__compiled:
+                compiled_function = ModelCompiler.get_compiled_function(
+                    self.__model, self.__loss_fun, inputs, target, autocast_dtype
+                )
+                if compiled_function is not None:
+                    loss, output = compiled_function(
+                        get_model_tensors(self.__model), inputs, target
+                    )
+                    return {"loss": loss, "output": output}
+            output = model(inputs)
+        if autocast_dtype is not None:
+            output = output.float()
         loss = self.__loss_fun(output, target)
         return {"loss": loss, "output": output}
 
+    @staticmethod
+    def __get_autocast_context(inputs, autocast_dtype):
+        if autocast_dtype is None:
+            return contextlib.nullcontext()
+        if isinstance(inputs, torch.Tensor):
+            device = inputs.device
+        else:
+            device = inputs[0].device
+        return torch.autocast(device_type=device.type, dtype=autocast_dtype)
+
     def __choose_loss_function(self) -> Optional[torch.nn.modules.loss._Loss]:
         if isinstance(self.__model, GeneralizedRCNN):
             return None
@@ -89,6 +205,9 @@ class ModelWithLoss:
         raise NotImplementedError()
 
     def is_averaged_loss(self) -> bool:
+        # detection models return the means of their losses over the batch
+        if isinstance(self.__model, GeneralizedRCNN):
+            return True
         if hasattr(self.loss_fun, "reduction"):
             if self.loss_fun.reduction in ("mean", "elementwise_mean"):
                 return True
@@ -0,0 +1,81 @@
+import contextlib
+import time
+from typing import Callable
+
+import numpy
+
+
+def get_callback_name(callback: Callable) -> str:
+    # instances of callable classes are named by their classes
+    return getattr(callback, "__qualname__", None) or type(callback).__qualname__
+
+
+class PhaseTimer:
+    r"""
+    Record the wall time of named phases in each batch and summarize them per epoch.
+    Only the host clock is read, so with a GPU the time of asynchronous kernels shows up in the phase that waits for them.
+    """
+
+    def __init__(self):
+        self.__batch_times: dict = dict()
+        self.__current_batch_times: dict = dict()
+        self.__sample_num = 0
+        self.__batch_num = 0
+        self.__batch_time = 0.0
+        self.__start_time = time.perf_counter()
+
+    def reset(self):
+        self.__init__()
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start_time)
+
+    def record(self, name: str, seconds: float):
+        self.__current_batch_times[name] = (
+            self.__current_batch_times.get(name, 0.0) + seconds
+        )
+
+    def end_batch(self, sample_num: int, batch_time: float):
+        for name, seconds in self.__current_batch_times.items():
+            if name not in self.__batch_times:
+                self.__batch_times[name] = []
+            self.__batch_times[name].append(seconds)
+        self.__current_batch_times = dict()
+        self.__sample_num += sample_num
+        self.__batch_num += 1
+        self.__batch_time += batch_time
+
+    def get_statistics(self) -> dict:
+        r"""
+        Return the total, mean and percentiles in seconds of each phase, phases recorded outside batches count as one sample.
+        samples_per_second only counts the time spent in batches.
+        """
+        phases = dict()
+        batch_times = dict(self.__batch_times)
+        for name, seconds in self.__current_batch_times.items():
+            batch_times[name] = batch_times.get(name, []) + [seconds]
+        for name, times in batch_times.items():
+            times = numpy.array(times)
+            p50, p90, p99 = numpy.percentile(times, [50, 90, 99])
+            phases[name] = {
+                "total": float(times.sum()),
+                "mean": float(times.mean()),
+                "p50": float(p50),
+                "p90": float(p90),
+                "p99": float(p99),
+            }
+        samples_per_second = 0.0
+        if self.__batch_time > 0:
+            samples_per_second = self.__sample_num / self.__batch_time
+        return {
+            "batch_num": self.__batch_num,
+            "sample_num": self.__sample_num,
+            "samples_per_second": samples_per_second,
+            "elapsed_time": time.perf_counter() - self.__start_time,
+            "phases": phases,
+        }
@@ -0,0 +1,176 @@
+import copy
+import logging
+import multiprocessing
+import pickle
+import queue
+import random
+from typing import Callable, Optional
+
+import numpy
+import torch
+from cyy_naive_lib.log import get_logger
+
+from reproducible_env import ReproducibleEnv
+
+
+class RunningStatistics:
+    r"""
+    Incremental mean and sample variance of tensors by Welford's algorithm.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.__mean: Optional[torch.Tensor] = None
+        self.__m2: Optional[torch.Tensor] = None
+
+    def add(self, tensor: torch.Tensor):
+        tensor = tensor.double()
+        self.count += 1
+        if self.__mean is None:
+            self.__mean = tensor.clone()
+            self.__m2 = torch.zeros_like(tensor)
+            return
+        if tensor.shape != self.__mean.shape:
+            raise RuntimeError(
+                "shape mismatch:" + str(tensor.shape) + " " + str(self.__mean.shape)
+            )
+        delta = tensor - self.__mean
+        self.__mean += delta / self.count
+        self.__m2 += delta * (tensor - self.__mean)
+
+    @property
+    def mean(self) -> Optional[torch.Tensor]:
+        return self.__mean
+
+    @property
+    def variance(self) -> Optional[torch.Tensor]:
+        if self.__m2 is None:
+            return None
+        if self.count < 2:
+            return torch.zeros_like(self.__m2)
+        return self.__m2 / (self.count - 1)
+
+
+def statistic_to_tensor(value) -> torch.Tensor:
+    if isinstance(value, list):
+        return torch.Tensor(value)
+    if isinstance(value, dict):
+        return torch.Tensor([value[k] for k in sorted(value.keys())])
+    raise RuntimeError("unsupported value" + str(value))
+
+
+def copy_trainer_with_shared_datasets(trainer):
+    r"""
+    Deep copy the trainer except its datasets, which are shared since they are read-only.
+    """
+    memo = {
+        id(dataset): dataset
+        for dataset in (
+            trainer.training_dataset,
+            trainer.validation_dataset,
+            trainer.test_dataset,
+        )
+        if dataset is not None
+    }
+    return copy.deepcopy(trainer, memo)
+
+
+def __run(
+    run_idx: int,
+    seed: int,
+    thread_num: int,
+    trainer,
+    training_callback: Callable,
+    deterministic: bool,
+    result_queue,
+):
+    try:
+        get_logger().setLevel(logging.ERROR)
+        torch.set_num_threads(thread_num)
+        if deterministic:
+            ReproducibleEnv(seed=seed).enable()
+        else:
+            torch.manual_seed(seed)
+            random.seed(seed)
+            numpy.random.seed(seed % (2 ** 32))
+        trainer = copy_trainer_with_shared_datasets(trainer)
+        result = (run_idx, training_callback(run_idx, trainer))
+    except BaseException as e:
+        result = (run_idx, e)
+    result_queue.put(pickle.dumps(result))
+
+
+def run_repeated_training(
+    number: int,
+    trainer,
+    training_callback: Callable,
+    worker_num: Optional[int] = None,
+    result_callback: Optional[Callable] = None,
+    with_variance: bool = False,
+    deterministic: bool = False,
+):
+    r"""
+    Call training_callback(run_idx, trainer) number times in parallel processes,
+    each with its own copy of the trainer and its own seed, and deterministic algorithms only if deterministic is set.
+    The seeds are drawn from the torch random state of this process, so later calls get new seeds.
+    training_callback returns a dict of lists or dicts of numbers, which are passed to result_callback(run_idx, statistics) as soon as a run finishes.
+    Return the mean of each statistic over all runs, and also the sample variance of each statistic if with_variance is set.
+    Processes are forked so that the datasets are shared, thus CUDA must not be initialized in this process.
+    """
+    assert number >= 1
+    cpu_count = multiprocessing.cpu_count()
+    if worker_num is None:
+        worker_num = min(number, cpu_count)
+    thread_num = max(1, cpu_count // worker_num)
+    base_seed = int(torch.randint(2 ** 31, (1,)).item())
+    ctx = multiprocessing.get_context("fork")
+    result_queue = ctx.Queue()
+    processes: dict = dict()
+    statistics: dict = dict()
+    next_run_idx = 0
+    finished_run_num = 0
+    try:
+        while finished_run_num < number:
+            while next_run_idx < number and len(processes) < worker_num:
+                process = ctx.Process(
+                    target=__run,
+                    args=(
+                        next_run_idx,
+                        base_seed + next_run_idx,
+                        thread_num,
+                        trainer,
+                        training_callback,
+                        deterministic,
+                        result_queue,
+                    ),
+                )
+                process.start()
+                processes[next_run_idx] = process
+                next_run_idx += 1
+            try:
+                run_idx, result = pickle.loads(result_queue.get(timeout=1))
+            except queue.Empty:
+                for run_idx, process in processes.items():
+                    if process.exitcode:
+                        raise RuntimeError(
+                            "run %s exits with %s" % (run_idx, process.exitcode)
+                        )
+                continue
+            processes.pop(run_idx).join()
+            if isinstance(result, BaseException):
+                raise result
+            finished_run_num += 1
+            get_logger().info("run %s finished", run_idx)
+            for k, v in result.items():
+                if k not in statistics:
+                    statistics[k] = RunningStatistics()
+                statistics[k].add(statistic_to_tensor(v))
+            if result_callback is not None:
+                result_callback(run_idx, result)
+    finally:
+        for process in processes.values():
+            process.terminate()
+    means = {k: v.mean for k, v in statistics.items()}
+    if with_variance:
+        return (means, {k: v.variance for k, v in statistics.items()})
+    return means
@@ -9,7 +9,7 @@ from cyy_naive_lib.log import get_logger
 
 
 class ReproducibleEnv:
-    def __init__(self, path: str = None):
+    def __init__(self, path: str = None, seed: int = None):
         self.torch_seed = None
         self.randomlib_state = None
         self.numpy_state = None
@@ -17,6 +17,10 @@ class ReproducibleEnv:
 
         if path is not None:
             self.load(path)
+        elif seed is not None:
+            self.torch_seed = seed
+            self.randomlib_state = random.Random(seed).getstate()
+            self.numpy_state = numpy.random.RandomState(seed % (2 ** 32)).get_state()
 
     def enable(self):
         """
@@ -31,7 +35,7 @@ class ReproducibleEnv:
         os.environ["CUBLAS_WORKSPACE_CONFIG"] = ":4096:8"
         torch.backends.cudnn.deterministic = True
         torch.backends.cudnn.benchmark = False
-        torch.set_deterministic(True)
+        torch.use_deterministic_algorithms(True)
 
         if self.torch_seed is not None:
             get_logger().warning("overwrite torch seed")
@@ -63,7 +67,7 @@ class ReproducibleEnv:
         os.environ.pop("CUBLAS_WORKSPACE_CONFIG")
         torch.backends.cudnn.deterministic = False
         torch.backends.cudnn.benchmark = True
-        torch.set_deterministic(False)
+        torch.use_deterministic_algorithms(False)
 
     def __enter__(self):
         self.enable()
@@ -0,0 +1,68 @@
+import time
+
+
+class StopCriterion:
+    r"""
+    A criterion is called as criterion(trainer, epoch, kwargs) after each epoch, where kwargs are the arguments of train,
+    and training stops when it returns True.
+    If needs_validation is set, the trainer waits for pending evaluations before calling it.
+    """
+
+    needs_validation = False
+
+    def __call__(self, trainer, epoch: int, kwargs: dict) -> bool:
+        raise NotImplementedError()
+
+
+class TargetAccuracyCriterion(StopCriterion):
+    needs_validation = True
+
+    def __init__(self, accuracy: float):
+        self.__accuracy = accuracy
+
+    def __call__(self, trainer, epoch: int, kwargs: dict) -> bool:
+        accuracy = trainer.validation_accuracy.get(epoch)
+        return accuracy is not None and accuracy >= self.__accuracy
+
+
+class ValidationLossPatienceCriterion(StopCriterion):
+    r"""
+    Stop if the validation loss has not decreased by more than min_delta for patience epochs.
+    """
+
+    needs_validation = True
+
+    def __init__(self, patience: int, min_delta: float = 0):
+        assert patience > 0
+        self.__patience = patience
+        self.__min_delta = min_delta
+
+    def __call__(self, trainer, epoch: int, kwargs: dict) -> bool:
+        best_epoch = None
+        best_loss = None
+        for validation_epoch in sorted(trainer.validation_loss.keys()):
+            if validation_epoch > epoch:
+                break
+            loss = trainer.validation_loss[validation_epoch]
+            if best_loss is None or loss < best_loss - self.__min_delta:
+                best_epoch = validation_epoch
+                best_loss = loss
+        return best_epoch is not None and epoch - best_epoch >= self.__patience
+
+
+class TimeBudgetCriterion(StopCriterion):
+    r"""
+    Stop if another epoch of average length would exceed the budget in seconds counted from the start of train.
+    """
+
+    def __init__(self, seconds: float):
+        self.__seconds = seconds
+
+    def __call__(self, trainer, epoch: int, kwargs: dict) -> bool:
+        start_time = trainer.get_data("training_start_time")
+        start_epoch = trainer.get_data("training_start_epoch")
+        if start_time is None or start_epoch is None:
+            return False
+        elapsed_time = time.time() - start_time
+        epoch_time = elapsed_time / (epoch - start_epoch + 1)
+        return elapsed_time + epoch_time > self.__seconds
@@ -12,3 +12,15 @@ def get_batch_size(tensors):
     if isinstance(tensors, list):
         return len(tensors)
     raise RuntimeError("invalid tensors:" + str(tensors))
+
+
+def split_batch(tensors, micro_batch_num: int) -> list:
+    r"""
+    Split a batch of tensors or a list into at most micro_batch_num consecutive micro-batches.
+    """
+    batch_size = get_batch_size(tensors)
+    micro_batch_size = (batch_size + micro_batch_num - 1) // micro_batch_num
+    return [
+        tensors[i : i + micro_batch_size]
+        for i in range(0, batch_size, micro_batch_size)
+    ]
@@ -27,8 +27,10 @@ def test_hessian_vector_product():
 
         with TimeCounter() as c:
             a = hvp_function(v)
-            print("one use time ", c.elapsed_milliseconds())
+            one_use_time = c.elapsed_milliseconds()
+            print("one use time ", one_use_time)
             print(a)
+            product = a
             c.reset_start_time()
             a = hvp_function([v, 2 * v])
             print("two use time ", c.elapsed_milliseconds())
@@ -51,7 +53,12 @@ def test_hessian_vector_product():
             print("64 use time ", c.elapsed_milliseconds())
             c.reset_start_time()
             a = hvp_function([v] * 64)
-            print("64 use time ", c.elapsed_milliseconds())
+            sixty_four_use_time = c.elapsed_milliseconds()
+            print("64 use time ", sixty_four_use_time)
+            # timing is too noisy to assert, batched products must match the single one
+            assert len(a) == 64
+            for b in a:
+                assert torch.linalg.norm(b - product, ord=2).data.item() < 0.0005
             c.reset_start_time()
             a = hvp_function([v] * 100)
             print("100 use time ", c.elapsed_milliseconds())
@@ -63,3 +70,57 @@ def test_hessian_vector_product():
             #     a = hvp_function([v] * 100)
             #     print("100 use time ", c.elapsed_milliseconds())
         break
+
+
+def test_cached_hessian_vector_product():
+    trainer = get_trainer_from_configuration("MNIST", "LeNet5")
+    training_data_loader = torch.utils.data.DataLoader(
+        trainer.training_dataset,
+        batch_size=16,
+        shuffle=True,
+    )
+    parameter_vector = ModelUtil(trainer.model).get_parameter_list()
+    v = torch.ones(parameter_vector.shape)
+    for batch in training_data_loader:
+        hvp_function = get_hessian_vector_product_func(trainer.model_with_loss, batch)
+        cached_hvp_function = get_hessian_vector_product_func(
+            trainer.model_with_loss, batch, cache_graph=True
+        )
+        a = hvp_function([v, 2 * v])
+        b = cached_hvp_function([v, 2 * v])
+        assert torch.linalg.norm(a[0] - b[0], ord=2).data.item() < 0.0005
+        assert torch.linalg.norm(a[1] - b[1], ord=2).data.item() < 0.0005
+        with TimeCounter() as c:
+            for _ in range(10):
+                cached_hvp_function(v)
+            print("10 cached use time ", c.elapsed_milliseconds())
+        cached_hvp_function.release()
+        break
+
+
+def test_released_hessian_vector_product():
+    trainer = get_trainer_from_configuration("MNIST", "LeNet5")
+    training_data_loader = torch.utils.data.DataLoader(
+        trainer.training_dataset,
+        batch_size=16,
+        shuffle=True,
+    )
+    parameter_vector = ModelUtil(trainer.model).get_parameter_list()
+    v = torch.ones(parameter_vector.shape)
+    for batch in training_data_loader:
+        hvp_function = get_hessian_vector_product_func(trainer.model_with_loss, batch)
+        # the workers can't cache the graph under this cap
+        capped_hvp_function = get_hessian_vector_product_func(
+            trainer.model_with_loss, batch, max_cached_graph_bytes=1
+        )
+        a = hvp_function(v)
+        hvp_function.release()
+        b = hvp_function(v)
+        c = capped_hvp_function(v)
+        d = capped_hvp_function(v)
+        assert torch.linalg.norm(a - b, ord=2).data.item() < 0.0005
+        assert torch.linalg.norm(a - c, ord=2).data.item() < 0.0005
+        assert torch.linalg.norm(c - d, ord=2).data.item() < 0.0005
+        hvp_function.release()
+        capped_hvp_function.release()
+        break
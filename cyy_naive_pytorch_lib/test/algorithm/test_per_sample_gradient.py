@@ -5,8 +5,12 @@ from cyy_naive_lib.time_counter import TimeCounter
 from cyy_naive_lib.profiling import Profile
 
 from configuration import get_trainer_from_configuration
-from algorithm.per_sample_gradient import get_per_sample_gradient
+from algorithm.per_sample_gradient import (
+    get_batched_per_sample_gradient,
+    get_per_sample_gradient,
+)
 from device import get_device
+from model_loss import ModelWithLoss
 
 
 def test_get_per_sample_gradient():
@@ -34,3 +38,52 @@ def test_get_per_sample_gradient():
             get_per_sample_gradient(
                 trainer.model_with_loss, batch[0], batch[1])
             break
+
+
+def test_get_batched_per_sample_gradient():
+    trainer = get_trainer_from_configuration("MNIST", "LeNet5")
+    training_data_loader = torch.utils.data.DataLoader(
+        trainer.training_dataset,
+        batch_size=64,
+        shuffle=True,
+    )
+
+    trainer.model.cpu()
+    for cnt, batch in enumerate(training_data_loader):
+        with TimeCounter() as c:
+            gradient_matrix = get_batched_per_sample_gradient(
+                trainer.model_with_loss, batch[0], batch[1]
+            )
+            print("batched per sample gradient use time ", c.elapsed_milliseconds())
+            c.reset_start_time()
+            gradients = get_per_sample_gradient(
+                trainer.model_with_loss, batch[0], batch[1]
+            )
+            print("looped per sample gradient use time ", c.elapsed_milliseconds())
+        assert gradient_matrix.shape[0] == len(gradients)
+        for row, gradient in zip(gradient_matrix, gradients):
+            assert torch.linalg.norm(row - gradient.cpu(), ord=2).data.item() < 0.0005
+        if cnt > 3:
+            break
+
+
+def test_get_batched_per_sample_gradient_with_dropout():
+    model = torch.nn.Sequential(
+        torch.nn.Linear(8, 16), torch.nn.Dropout(0.5), torch.nn.Linear(16, 2)
+    )
+    model_with_loss = ModelWithLoss(model, torch.nn.CrossEntropyLoss())
+    inputs = torch.randn(1, 8).repeat(16, 1)
+    targets = torch.zeros(16, dtype=torch.long)
+    model.train()
+    gradient_matrix = get_batched_per_sample_gradient(
+        model_with_loss, inputs, targets
+    )
+    assert gradient_matrix.shape == (16, sum(p.numel() for p in model.parameters()))
+    # identical samples get different dropout masks
+    assert not torch.allclose(gradient_matrix[0], gradient_matrix[1:])
+
+    model.eval()
+    gradient_matrix = get_batched_per_sample_gradient(
+        model_with_loss, inputs, targets
+    )
+    assert torch.allclose(gradient_matrix[0], gradient_matrix[1:])
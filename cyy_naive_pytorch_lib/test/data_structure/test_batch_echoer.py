@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+import time
+
+import torch
+
+from data_structure.batch_echoer import BatchEchoer
+
+
+def test_batch_echoer():
+    batches = [
+        (torch.randn(4, 2), torch.zeros(4), torch.arange(i * 4, i * 4 + 4))
+        for i in range(3)
+    ]
+    items = list(
+        BatchEchoer(
+            [(batch, None) for batch in batches],
+            decode_fun=lambda batch: batch,
+            echo_num=2,
+            echo_fun=lambda inputs: inputs + 1,
+        )
+    )
+    assert [item[:2] for item in items] == [(i, j) for i in range(3) for j in range(2)]
+    for batch_index, echo_index, batch, decoded_batch in items:
+        assert batch is batches[batch_index]
+        assert torch.equal(decoded_batch[2], batches[batch_index][2])
+        assert torch.equal(decoded_batch[0], batches[batch_index][0] + echo_index)
+
+
+def test_adaptive_batch_echoer():
+    def slow_batches():
+        for i in range(5):
+            time.sleep(0.05)
+            yield (torch.tensor([i]), None)
+
+    batch_echoer = BatchEchoer(
+        slow_batches(), decode_fun=lambda batch: batch, max_echo_num=3
+    )
+    assert len(list(batch_echoer)) > 5
+    assert batch_echoer.echo_num == 3
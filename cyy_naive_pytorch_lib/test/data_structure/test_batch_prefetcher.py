@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+import torch
+
+from checkpoint import get_random_states
+from data_structure.batch_prefetcher import BatchPrefetcher
+
+
+class RandomBatches:
+    def __iter__(self):
+        # like random transforms in the main process
+        return (torch.rand(1) for _ in range(4))
+
+
+def test_skip_and_restore_random_states():
+    torch.manual_seed(0)
+    iterator = iter(RandomBatches())
+    skipped_batches = [next(iterator), next(iterator)]
+    random_states = get_random_states()
+    expected_batches = list(iterator)
+
+    torch.manual_seed(0)
+    batch_prefetcher = BatchPrefetcher(
+        RandomBatches(),
+        depth=0,
+        decode_fun=lambda batch: batch,
+        skipped_batch_num=len(skipped_batches),
+        random_states=random_states,
+    )
+    # random draws between the skipped batches and the rest are undone
+    torch.rand(1)
+    batches = [batch for batch, _ in batch_prefetcher]
+    assert len(batches) == 2
+    for batch, expected_batch in zip(batches, expected_batches):
+        assert torch.equal(batch, expected_batch)
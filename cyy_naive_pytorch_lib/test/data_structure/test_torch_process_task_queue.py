@@ -0,0 +1,15 @@
+from data_structure.torch_process_task_queue import TorchProcessTaskQueue
+
+
+def hello(task, args):
+    assert args
+    return args
+
+
+def test_process_task_queue():
+    queue = TorchProcessTaskQueue(hello, worker_num=2)
+    queue.start()
+    queue.add_task(())
+    devices = queue.get_result()
+    assert devices
+    queue.stop()
@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+import math
+
+from configuration import get_trainer_from_configuration
+from data_pruning import prune_training_dataset, score_training_samples
+from dataset import sub_dataset
+
+
+def test_data_pruning():
+    trainer = get_trainer_from_configuration("MNIST", "LeNet5")
+    trainer.set_training_dataset(
+        sub_dataset(trainer.training_dataset, range(100, 200))
+    )
+    trainer.hyper_parameter.set_epoch(2)
+    scores = score_training_samples(trainer, 1, "forgetting")
+    assert len(scores) == 100
+    assert all(score >= 0 or math.isinf(score) for score in scores.tolist())
+
+    kept_indices = prune_training_dataset(trainer, 0.3, 1)
+    assert len(kept_indices) == 70
+    # the kept indices are in the full MNIST training set
+    assert all(100 <= index < 200 for index in kept_indices)
+    assert len(trainer.training_dataset) == 70
+    trainer.train()
@@ -0,0 +1,15 @@
+#!/usr/bin/env python3
+from configuration import get_trainer_from_configuration
+from dataloader_tuner import tune_dataloader
+from dataset import sub_dataset
+
+
+def test_tune_dataloader():
+    trainer = get_trainer_from_configuration("MNIST", "LeNet5")
+    trainer.set_training_dataset(sub_dataset(trainer.training_dataset, range(100)))
+    trainer.hyper_parameter.set_batch_size(10)
+    config = tune_dataloader(
+        trainer, worker_nums=[0, 2], prefetch_factors=[2], batch_num=3
+    )
+    assert config["worker_num"] in (0, 2)
+    assert config["training_samples_per_second"] > 0
@@ -0,0 +1,18 @@
+#!/usr/bin/env python3
+from configuration import get_trainer_from_configuration
+from dataset import sub_dataset
+from distributed import get_world_size, run_data_parallel, train_data_parallel
+
+
+def test_run_data_parallel():
+    assert run_data_parallel(get_world_size, 2) == 2
+
+
+def test_train_data_parallel():
+    trainer = get_trainer_from_configuration("MNIST", "LeNet5")
+    trainer.set_training_dataset(sub_dataset(trainer.training_dataset, range(16)))
+    trainer.hyper_parameter.set_epoch(1)
+    trainer.hyper_parameter.set_batch_size(4)
+    train_data_parallel(trainer, 2)
+    assert len(trainer.training_loss) == 1
+    assert 1 in trainer.validation_accuracy
@@ -1,8 +1,64 @@
 #!/usr/bin/env python3
 
+import torch
+
 import hyper_parameter
+from ml_types import MachineLearningPhase
 
 
 def test_hyper_parameter():
     res = hyper_parameter.get_recommended_hyper_parameter("MNIST", "")
     assert res is not None
+
+
+def test_dataloader_cache():
+    res = hyper_parameter.get_recommended_hyper_parameter("MNIST", "")
+    res.set_dataloader_worker_num(2)
+    dataset = list(zip(range(10), range(10)))
+    dataloader = res.get_dataloader(dataset, MachineLearningPhase.Training)
+    assert dataloader is res.get_dataloader(dataset, MachineLearningPhase.Training)
+    for _ in range(2):
+        assert sum(len(batch[0]) for batch in dataloader) == 10
+    hyper_parameter.HyperParameter.release_dataloaders()
+    assert dataloader is not res.get_dataloader(
+        dataset, MachineLearningPhase.Training
+    )
+
+
+def test_evaluation_dataloader_random_state():
+    res = hyper_parameter.get_recommended_hyper_parameter("MNIST", "")
+    res.set_dataloader_worker_num(0)
+    dataset = list(zip(range(10), range(10)))
+    random_state = torch.get_rng_state()
+    for _ in res.get_dataloader(dataset, MachineLearningPhase.Validation):
+        pass
+    # evaluation does not disturb the random state of training
+    assert torch.equal(random_state, torch.get_rng_state())
+
+
+def test_scale_batch_size():
+    res = hyper_parameter.get_recommended_hyper_parameter("MNIST", "")
+    res.set_optimizer_factory(hyper_parameter.HyperParameter.get_optimizer_factory("LARS"))
+    learning_rate = res.learning_rate
+    res.scale_batch_size(res.batch_size * 2, world_size=4)
+    assert res.learning_rate == learning_rate * 8
+    assert res.warmup_epoch == 3
+    optimizer = res.get_optimizer(torch.nn.Linear(2, 2).parameters(), 100)
+    # the lr scheduler is kept unless the warmup schedule is asked for, but it still warms up
+    lr_scheduler = res.get_lr_scheduler(optimizer, 100)
+    assert isinstance(lr_scheduler, hyper_parameter.LinearWarmupLR)
+    assert isinstance(
+        lr_scheduler.lr_scheduler, torch.optim.lr_scheduler.ReduceLROnPlateau
+    )
+    learning_rates = []
+    for _ in range(4):
+        learning_rates.append(optimizer.param_groups[0]["lr"])
+        lr_scheduler.step(1.0)
+    for epoch, learning_rate in enumerate(learning_rates, start=1):
+        assert abs(learning_rate - res.learning_rate * epoch / 4) < 1e-9
+    res.scale_batch_size(res.batch_size * 2, use_warmup_lr_scheduler=True)
+    lr_scheduler = res.get_lr_scheduler(optimizer, 100)
+    assert hyper_parameter.HyperParameter.lr_scheduler_step_after_batch(lr_scheduler)
+    assert not hyper_parameter.HyperParameter.lr_scheduler_step_after_batch(
+        torch.optim.lr_scheduler.LambdaLR(optimizer, lambda epoch: 1)
+    )
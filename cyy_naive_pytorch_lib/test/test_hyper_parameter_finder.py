@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+from configuration import get_trainer_from_configuration
+from dataset import sub_dataset
+from hyper_parameter_finder import find_batch_size, find_hyper_parameter
+from ml_types import MachineLearningPhase
+
+
+def test_find_hyper_parameter():
+    trainer = get_trainer_from_configuration("MNIST", "LeNet5")
+    trainer.set_training_dataset(sub_dataset(trainer.training_dataset, range(256)))
+    trainer.hyper_parameter.set_dataloader_worker_num(0)
+    dataloader = trainer.hyper_parameter.get_dataloader(
+        trainer.training_dataset, MachineLearningPhase.Training
+    )
+    assert find_batch_size(trainer, memory_budget=2 ** 40, max_batch_size=64) == 64
+    # the cached dataloaders are kept
+    assert (
+        trainer.hyper_parameter.get_dataloader(
+            trainer.training_dataset, MachineLearningPhase.Training
+        )
+        is dataloader
+    )
+    config = find_hyper_parameter(
+        trainer, memory_budget=4 * 2 ** 20, max_lr=1, batch_num=20
+    )
+    assert config["batch_size"] == trainer.hyper_parameter.batch_size
+    assert 1e-7 <= config["learning_rate"] <= 1
+    assert config["max_learning_rate"] == trainer.hyper_parameter.max_learning_rate
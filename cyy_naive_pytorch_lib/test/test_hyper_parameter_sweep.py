@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+import os
+import tempfile
+
+from checkpoint import CHECKPOINT_FILE_NAME
+from configuration import get_trainer_from_configuration
+from dataset import sub_dataset
+from hyper_parameter_sweep import sweep_hyper_parameter
+
+
+def test_sweep_hyper_parameter():
+    trainer = get_trainer_from_configuration("MNIST", "LeNet5")
+    trainer.set_training_dataset(sub_dataset(trainer.training_dataset, range(10)))
+    with tempfile.TemporaryDirectory() as save_dir:
+        best = sweep_hyper_parameter(
+            trainer,
+            {"learning_rate": [0.001, 0.01], "batch_size": [2, 4]},
+            trial_num=4,
+            max_epoch=2,
+            reduction_factor=2,
+            save_dir=save_dir,
+        )
+        # each trial trains at least one epoch and writes its checkpoint
+        for trial_id in range(4):
+            assert os.path.isfile(
+                os.path.join(save_dir, str(trial_id), CHECKPOINT_FILE_NAME)
+            )
+    assert best["epoch"] == 2
+    assert 0 <= best["validation_accuracy"] <= 1
+    assert set(best["config"].keys()) == {"learning_rate", "batch_size"}
@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+
+import torch
+
+from large_batch_optimizer import LAMB, LARS
+
+
+def test_large_batch_optimizer():
+    inputs = torch.randn(256, 20)
+    targets = inputs @ torch.randn(20, 1)
+    for optimizer_factory, kwargs in (
+        (LARS, {"lr": 0.5, "weight_decay": 1e-4}),
+        (LAMB, {"lr": 0.05, "weight_decay": 1e-4}),
+    ):
+        model = torch.nn.Sequential(
+            torch.nn.Linear(20, 32), torch.nn.ReLU(), torch.nn.Linear(32, 1)
+        )
+        optimizer = optimizer_factory(model.parameters(), **kwargs)
+        losses = []
+        for _ in range(300):
+            optimizer.zero_grad()
+            loss = torch.nn.functional.mse_loss(model(inputs), targets)
+            loss.backward()
+            optimizer.step()
+            losses.append(loss.item())
+        assert losses[-1] < losses[0] / 10
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+
+import torch
+from cyy_naive_lib.time_counter import TimeCounter
+from torchvision.models import MobileNetV2
+
+from ml_types import MachineLearningPhase
+from model_loss import ModelWithLoss
+from models.densenet import DenseNet40
+from models.lenet import LeNet5
+from models.senet.se_resnet import CifarSEBasicBlock, CifarSEResNet
+
+
+def test_autocast_throughput():
+    batch_size = 32
+    for model, input_shape in (
+        (LeNet5(input_channels=1), (1, 32, 32)),
+        (DenseNet40(num_classes=10, channels=3), (3, 32, 32)),
+        (MobileNetV2(num_classes=10), (3, 32, 32)),
+    ):
+        model_with_loss = ModelWithLoss(model)
+        model_with_loss.set_model_mode(MachineLearningPhase.Training)
+        inputs = torch.randn(batch_size, *input_shape)
+        targets = torch.randint(0, 10, (batch_size,))
+        for autocast_dtype in (None, torch.bfloat16):
+            with TimeCounter() as c:
+                for _ in range(3):
+                    model.zero_grad()
+                    loss = model_with_loss(
+                        inputs,
+                        targets,
+                        phase=MachineLearningPhase.Training,
+                        autocast_dtype=autocast_dtype,
+                    )["loss"]
+                    loss.backward()
+                assert loss.dtype == torch.float32
+                print(
+                    model.__class__.__name__,
+                    autocast_dtype,
+                    "training throughput",
+                    3 * batch_size * 1000 / c.elapsed_milliseconds(),
+                    "samples/s",
+                )
+
+
+def test_compiled_model_with_loss():
+    batch_size = 32
+    model = LeNet5(input_channels=1)
+    model_with_loss = ModelWithLoss(model)
+    inputs = torch.randn(batch_size, 1, 32, 32)
+    targets = torch.randint(0, 10, (batch_size,))
+    eager_loss = model_with_loss(
+        inputs, targets, phase=MachineLearningPhase.Training
+    )["loss"]
+    model_with_loss.set_compiled(True)
+    model_with_loss.warm_up(inputs, targets, phase=MachineLearningPhase.Training)
+    with TimeCounter() as c:
+        compiled_loss = model_with_loss(
+            inputs, targets, phase=MachineLearningPhase.Training
+        )["loss"]
+        compiled_loss.backward()
+        print("compiled training step", c.elapsed_milliseconds(), "ms")
+    assert torch.allclose(eager_loss, compiled_loss, atol=1e-5)
+    assert all(parameter.grad is not None for parameter in model.parameters())
+
+
+def test_channels_last_throughput():
+    batch_size = 32
+    for model, input_shape in (
+        (LeNet5(input_channels=1), (1, 32, 32)),
+        (DenseNet40(num_classes=10, channels=3), (3, 32, 32)),
+        (CifarSEResNet(CifarSEBasicBlock, 3, num_classes=10), (3, 32, 32)),
+        (MobileNetV2(num_classes=10), (3, 32, 32)),
+    ):
+        model_with_loss = ModelWithLoss(model)
+        inputs = torch.randn(batch_size, *input_shape)
+        targets = torch.randint(0, 10, (batch_size,))
+        for channels_last in (False, True):
+            model_with_loss.set_channels_last(channels_last)
+            model_with_loss.set_model_mode(MachineLearningPhase.Training)
+            with TimeCounter() as c:
+                for _ in range(3):
+                    model.zero_grad()
+                    model_with_loss(
+                        inputs, targets, phase=MachineLearningPhase.Training
+                    )["loss"].backward()
+                print(
+                    model.__class__.__name__,
+                    "channels_last" if channels_last else "contiguous",
+                    "training throughput",
+                    3 * batch_size * 1000 / c.elapsed_milliseconds(),
+                    "samples/s",
+                )
+            model_with_loss.set_model_mode(MachineLearningPhase.Test)
+            with torch.no_grad():
+                output = model_with_loss(
+                    inputs, targets, phase=MachineLearningPhase.Test
+                )["output"]
+            with torch.no_grad(), model_with_loss.fused_for_inference():
+                # the first call fuses the model in channels_last mode
+                fused_output = model_with_loss(
+                    inputs, targets, phase=MachineLearningPhase.Test
+                )["output"]
+                assert torch.allclose(output, fused_output, atol=1e-5)
+                with TimeCounter() as c:
+                    for _ in range(3):
+                        model_with_loss(
+                            inputs, targets, phase=MachineLearningPhase.Test
+                        )
+                    print(
+                        model.__class__.__name__,
+                        "channels_last" if channels_last else "contiguous",
+                        "inference throughput",
+                        3 * batch_size * 1000 / c.elapsed_milliseconds(),
+                        "samples/s",
+                    )
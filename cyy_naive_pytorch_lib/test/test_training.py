@@ -1,6 +1,15 @@
 #!/usr/bin/env python3
+import os
+import tempfile
+
+import torch
+
 from configuration import get_trainer_from_configuration
 from dataset import sub_dataset
+from ml_types import MachineLearningPhase
+from model_util import ModelUtil
+from repeated_training import copy_trainer_with_shared_datasets
+from stop_criterion import TargetAccuracyCriterion, TimeBudgetCriterion
 
 
 def test_training():
@@ -8,3 +17,179 @@ def test_training():
     trainer.set_training_dataset(sub_dataset(trainer.training_dataset, [0]))
     trainer.hyper_parameter.set_epoch(1)
     trainer.train()
+
+
+def test_training_with_prefetch():
+    trainer = get_trainer_from_configuration("MNIST", "LeNet5")
+    trainer.set_training_dataset(sub_dataset(trainer.training_dataset, range(10)))
+    trainer.hyper_parameter.set_epoch(1)
+    trainer.hyper_parameter.set_batch_size(2)
+    # batches are only prefetched from dataloader workers
+    trainer.hyper_parameter.set_dataloader_worker_num(1)
+    trainer.train(prefetch_depth=2)
+    assert trainer.get_data("data_wait_time") is not None
+
+
+def test_training_with_micro_batches():
+    trainer = get_trainer_from_configuration("MNIST", "LeNet5")
+    trainer.set_training_dataset(sub_dataset(trainer.training_dataset, range(8)))
+    trainer.hyper_parameter.set_epoch(1)
+    trainer.hyper_parameter.set_batch_size(8)
+    split_trainer = copy_trainer_with_shared_datasets(trainer)
+    torch.manual_seed(0)
+    trainer.train()
+    torch.manual_seed(0)
+    split_trainer.train(micro_batch_num=2)
+    assert split_trainer.get_data("cur_batch_size") == 8
+    # accumulated micro-batches take the same step as the whole batch
+    assert abs(split_trainer.training_loss[0] - trainer.training_loss[0]) < 1e-5
+    for name, parameter in split_trainer.model.named_parameters():
+        assert torch.allclose(
+            parameter, ModelUtil(trainer.model).get_attr(name), atol=1e-6
+        )
+
+
+def test_training_with_async_evaluation():
+    trainer = get_trainer_from_configuration("MNIST", "LeNet5")
+    trainer.set_training_dataset(sub_dataset(trainer.training_dataset, [0]))
+    trainer.hyper_parameter.set_epoch(2)
+    trainer.train(async_evaluation=True)
+    assert sorted(trainer.validation_accuracy.keys()) == [1, 2]
+    assert 2 in trainer.test_accuracy
+
+
+def test_evaluation_replica():
+    trainer = get_trainer_from_configuration("MNIST", "LeNet5")
+    inferencer = trainer.get_inferencer(MachineLearningPhase.Validation)
+    assert inferencer.model is not trainer.model
+    for parameter in trainer.model.parameters():
+        parameter.data.add_(1)
+    inferencer = trainer.get_inferencer(MachineLearningPhase.Validation)
+    for name, parameter in inferencer.model.named_parameters():
+        assert torch.equal(parameter, ModelUtil(trainer.model).get_attr(name))
+
+
+def test_evaluation_replica_modes():
+    trainer = get_trainer_from_configuration("MNIST", "LeNet5")
+    trainer.get_inferencer(MachineLearningPhase.Validation)
+    trainer.model_with_loss.set_channels_last(True)
+    inferencer = trainer.get_inferencer(MachineLearningPhase.Validation)
+    # the reused replica follows the mode of the model
+    for parameter in inferencer.model.parameters():
+        if parameter.dim() == 4:
+            assert parameter.is_contiguous(memory_format=torch.channels_last)
+    inferencer.inference()
+
+
+def test_checkpoint_and_resume():
+    with tempfile.TemporaryDirectory() as checkpoint_dir:
+        trainer = get_trainer_from_configuration("MNIST", "LeNet5")
+        trainer.set_training_dataset(sub_dataset(trainer.training_dataset, range(8)))
+        trainer.hyper_parameter.set_epoch(1)
+        trainer.hyper_parameter.set_batch_size(2)
+        trainer.train(
+            checkpoint_dir=checkpoint_dir,
+            checkpoint_batch_interval=2,
+            async_evaluation=True,
+        )
+        assert os.path.isfile(os.path.join(checkpoint_dir, "checkpoint.pt"))
+
+        resumed_trainer = get_trainer_from_configuration("MNIST", "LeNet5")
+        resumed_trainer.set_training_dataset(trainer.training_dataset)
+        resumed_trainer.hyper_parameter.set_epoch(2)
+        resumed_trainer.hyper_parameter.set_batch_size(2)
+        resumed_trainer.resume_from(checkpoint_dir)
+        # the last checkpoint is written after the evaluation of its epoch
+        assert 1 in resumed_trainer.validation_accuracy
+        for name, parameter in resumed_trainer.model.named_parameters():
+            assert torch.equal(
+                parameter.cpu(), ModelUtil(trainer.model).get_attr(name).cpu()
+            )
+        resumed_trainer.train()
+        assert len(resumed_trainer.training_loss) == 2
+        assert resumed_trainer.training_loss[0] == trainer.training_loss[0]
+
+
+def test_phase_time_statistics():
+    trainer = get_trainer_from_configuration("MNIST", "LeNet5")
+    trainer.set_training_dataset(sub_dataset(trainer.training_dataset, range(8)))
+    trainer.hyper_parameter.set_epoch(1)
+    trainer.hyper_parameter.set_batch_size(2)
+    epochs = []
+    trainer.add_callback(
+        "phase_time_callbacks", lambda trainer, epoch, statistics: epochs.append(epoch)
+    )
+    trainer.train()
+    assert epochs == [1]
+    statistics = trainer.get_data("phase_time_statistics")
+    assert statistics["batch_num"] == 4
+    assert statistics["samples_per_second"] > 0
+    for phase in ("data", "forward", "backward", "optimizer_step"):
+        assert statistics["phases"][phase]["p50"] > 0
+    assert any(
+        name.startswith("after_epoch_callbacks/") for name in statistics["phases"]
+    )
+
+
+def test_device_side_batch_loss():
+    trainer = get_trainer_from_configuration("MNIST", "LeNet5")
+    trainer.set_training_dataset(sub_dataset(trainer.training_dataset, range(4)))
+    trainer.hyper_parameter.set_epoch(1)
+    trainer.hyper_parameter.set_batch_size(2)
+    batch_losses = []
+    trainer.add_callback(
+        "after_batch_callbacks",
+        lambda trainer, batch_index, **kwargs: batch_losses.append(
+            kwargs["batch_loss"]
+        ),
+    )
+    trainer.train()
+    assert all(isinstance(loss, torch.Tensor) for loss in batch_losses)
+    assert isinstance(trainer.training_loss[0], float)
+
+
+def test_stop_criterion():
+    trainer = get_trainer_from_configuration("MNIST", "LeNet5")
+    trainer.set_training_dataset(sub_dataset(trainer.training_dataset, [0]))
+    trainer.hyper_parameter.set_epoch(5)
+    trainer.set_stop_criterion(TargetAccuracyCriterion(0))
+    trainer.train(async_evaluation=True)
+    assert len(trainer.training_loss) == 1
+    assert 1 in trainer.test_accuracy
+
+    trainer.set_stop_criterion(TimeBudgetCriterion(0))
+    trainer.train()
+    assert len(trainer.training_loss) == 1
+
+
+def test_repeated_training():
+    trainer = get_trainer_from_configuration("MNIST", "LeNet5")
+    trainer.set_training_dataset(sub_dataset(trainer.training_dataset, range(10)))
+    trainer.hyper_parameter.set_epoch(1)
+    finished_runs = []
+    training_losses = []
+
+    def result_callback(run_idx, statistics):
+        finished_runs.append(run_idx)
+        training_losses.append(statistics["training_loss"][0])
+
+    results = trainer.repeated_train(2, result_callback=result_callback)
+    assert sorted(finished_runs) == [0, 1]
+    assert results["training_loss"].shape == (1,)
+    trainer.repeated_train(2, result_callback=result_callback)
+    # later calls use new seeds
+    assert len(set(training_losses)) == 4
+    means, variances = trainer.repeated_train(2, with_variance=True)
+    assert means["test_accuracy"].shape == (1,)
+    assert variances["test_accuracy"].shape == (1,)
+
+
+def test_training_copied_trainer():
+    trainer = get_trainer_from_configuration("MNIST", "LeNet5")
+    trainer.set_training_dataset(sub_dataset(trainer.training_dataset, range(10)))
+    trainer.hyper_parameter.set_epoch(1)
+    copied_trainer = copy_trainer_with_shared_datasets(trainer)
+    copied_trainer.train()
+    assert len(copied_trainer.training_loss) == 1
+    assert copied_trainer.get_data("cur_learning_rates") is not None
+    assert trainer.get_data("cur_learning_rates") is None
@@ -1,3 +1,4 @@
+import concurrent.futures
 import datetime
 import threading
 
@@ -5,6 +6,7 @@ from cyy_naive_lib.algorithm.sequence_op import split_list_to_chunks
 from cyy_naive_lib.log import get_logger
 
 from basic_trainer import BasicTrainer
+from distributed import is_main_process
 from hyper_parameter import HyperParameter
 from ml_types import MachineLearningPhase
 from model_loss import ModelWithLoss
@@ -30,9 +32,41 @@ class Trainer(BasicTrainer):
             hyper_parameter=hyper_parameter,
         )
         self.visdom_env = None
+        self.__evaluation_executor = None
+        self.__evaluation_futures: list = []
         self.add_callback("pre_training_callbacks", self.__pre_training_callback)
         self.add_callback("after_batch_callbacks", Trainer.__after_batch_callback)
         self.add_callback("after_epoch_callbacks", Trainer.__plot_after_epoch)
+        self.add_callback("after_training_callbacks", Trainer.__test_after_training)
+
+    def train(self, **kwargs):
+        r"""
+        With async_evaluation=True, validation and test run in a background thread on copies of the model,
+        and their results appear in validation_loss, validation_accuracy, test_loss and test_accuracy when ready.
+        """
+        try:
+            super().train(**kwargs)
+        finally:
+            self.wait_for_evaluation()
+
+    def submit_evaluation(self, fun):
+        if self.__evaluation_executor is None:
+            self.__evaluation_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=1
+            )
+        self.__evaluation_futures.append(self.__evaluation_executor.submit(fun))
+
+    def wait_for_evaluation(self):
+        r"""
+        Block until all submitted evaluations finish, and raise their exceptions if any.
+        """
+        futures = self.__evaluation_futures
+        self.__evaluation_futures = []
+        for future in futures:
+            future.result()
+        if self.__evaluation_executor is not None:
+            self.__evaluation_executor.shutdown()
+            self.__evaluation_executor = None
 
     def __pre_training_callback(self, trainer):
         self.visdom_env = (
@@ -54,6 +88,8 @@ class Trainer(BasicTrainer):
 
     @staticmethod
     def __after_batch_callback(trainer: BasicTrainer, batch_index, batch, **kwargs):
+        if not is_main_process():
+            return
         training_set_size = trainer.get_data("training_set_size")
         ten_batches = training_set_size // (10 * get_batch_size(batch[0]))
         if ten_batches == 0 or batch_index % ten_batches == 0:
@@ -62,11 +98,14 @@ class Trainer(BasicTrainer):
                 kwargs["epoch"],
                 batch_index,
                 trainer.get_data("cur_learning_rates"),
-                kwargs["batch_loss"],
+                kwargs["batch_loss"].item(),
             )
 
     @staticmethod
     def __plot_after_epoch(trainer: BasicTrainer, epoch, **kwargs):
+        # in data parallel training, only rank 0 evaluates and plots
+        if not is_main_process():
+            return
         learning_rates = trainer.get_data("cur_learning_rates")
         assert len(learning_rates) == 1
         EpochWindow("learning rate", env=trainer.visdom_env).plot_learning_rate(
@@ -88,11 +127,66 @@ class Trainer(BasicTrainer):
         )
         loss_win.plot_loss(epoch, trainer.training_loss[-1], "training loss")
 
-        (
-            validation_loss,
-            accuracy,
-            other_data,
-        ) = trainer.get_inferencer(phase=MachineLearningPhase.Validation).inference()
+        async_evaluation = kwargs.get("async_evaluation", False)
+        if async_evaluation:
+            # the evaluation replicas are reused, so the last evaluation must finish first
+            trainer.wait_for_evaluation()
+        # the inferencers copy the weights here, so asynchronous evaluation sees the weights of this epoch
+        validation_inferencer = trainer.get_inferencer(
+            phase=MachineLearningPhase.Validation
+        )
+        test_inferencer = None
+        test_epoch_interval = int(kwargs.get("test_epoch_interval", 2))
+        if trainer.test_dataset is not None and (
+            epoch % test_epoch_interval == 0 or epoch == trainer.hyper_parameter.epoch
+        ):
+            test_inferencer = trainer.get_inferencer(phase=MachineLearningPhase.Test)
+
+        def evaluate():
+            Trainer.__validate(
+                trainer,
+                validation_inferencer,
+                epoch,
+                learning_rates,
+                kwargs.get("plot_class_accuracy", False),
+            )
+            if test_inferencer is not None:
+                Trainer.__test(trainer, test_inferencer, epoch, learning_rates)
+            Window.save_envs()
+
+        if async_evaluation:
+            trainer.submit_evaluation(evaluate)
+        else:
+            evaluate()
+
+    @staticmethod
+    def __test_after_training(trainer: BasicTrainer, epoch, **kwargs):
+        r"""
+        Test the last epoch if training stopped at an epoch without test.
+        """
+        if not is_main_process() or trainer.test_dataset is None or epoch == 0:
+            return
+        # the test of the last epoch may still be running
+        trainer.wait_for_evaluation()
+        if epoch in trainer.test_accuracy:
+            return
+        Trainer.__test(
+            trainer,
+            trainer.get_inferencer(phase=MachineLearningPhase.Test),
+            epoch,
+            trainer.get_data("cur_learning_rates"),
+        )
+        Window.save_envs()
+
+    @staticmethod
+    def __validate(
+        trainer: BasicTrainer,
+        inferencer,
+        epoch,
+        learning_rates,
+        plot_class_accuracy,
+    ):
+        (validation_loss, accuracy, other_data) = inferencer.inference()
         validation_loss = validation_loss.data.item()
         trainer.validation_loss[epoch] = validation_loss
         trainer.validation_accuracy[epoch] = accuracy
@@ -109,7 +203,6 @@ class Trainer(BasicTrainer):
             epoch, accuracy, "accuracy"
         )
 
-        plot_class_accuracy = kwargs.get("plot_class_accuracy", False)
         if plot_class_accuracy and "per_class_accuracy" in other_data:
             class_accuracy = other_data["per_class_accuracy"]
             for idx, sub_list in enumerate(
@@ -132,24 +225,19 @@ class Trainer(BasicTrainer):
                         "class_" + str(k) + "_accuracy",
                     )
 
-        test_epoch_interval = int(kwargs.get("test_epoch_interval", 2))
-        if trainer.test_dataset is not None and (
-            epoch % test_epoch_interval == 0 or epoch == trainer.hyper_parameter.epoch
-        ):
-            (test_loss, accuracy, _) = trainer.get_inferencer(
-                phase=MachineLearningPhase.Test
-            ).inference(per_class_accuracy=False)
-            test_loss = test_loss.data.item()
-            trainer.test_loss[epoch] = test_loss
-            trainer.test_accuracy[epoch] = accuracy
-            EpochWindow("test accuracy", env=trainer.visdom_env).plot_accuracy(
-                epoch, accuracy, "accuracy"
-            )
-            get_logger().info(
-                "epoch: %s, learning_rate: %s, test loss: %s, accuracy = %s",
-                epoch,
-                learning_rates,
-                test_loss,
-                accuracy,
-            )
-        Window.save_envs()
+    @staticmethod
+    def __test(trainer: BasicTrainer, inferencer, epoch, learning_rates):
+        (test_loss, accuracy, _) = inferencer.inference(per_class_accuracy=False)
+        test_loss = test_loss.data.item()
+        trainer.test_loss[epoch] = test_loss
+        trainer.test_accuracy[epoch] = accuracy
+        EpochWindow("test accuracy", env=trainer.visdom_env).plot_accuracy(
+            epoch, accuracy, "accuracy"
+        )
+        get_logger().info(
+            "epoch: %s, learning_rate: %s, test loss: %s, accuracy = %s",
+            epoch,
+            learning_rates,
+            test_loss,
+            accuracy,
+        )